@@ -0,0 +1,390 @@
+"""
+Benchmarks for the UploadFile XBlock hot paths.
+
+Runs offline against a stub XBlock runtime and a local filesystem (or
+in-memory) `default_storage`, and measures:
+
+* `student_view` render latency with N stored files
+* `refresh_content` latency
+* `stream_upload` and `upload_file` throughput and peak memory by file size and count
+* `download_file` time to first byte and peak memory
+
+Results are written as JSON so that runs of different versions can be
+compared:
+
+    python benchmarks/bench_uploadfile.py --output before.json
+    python benchmarks/bench_uploadfile.py --output after.json --compare before.json
+"""
+import argparse
+import base64
+import datetime
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MB = 1024 * 1024
+
+
+def setup_django(storage):
+    import django  # pylint: disable=import-outside-toplevel
+    from django.conf import settings  # pylint: disable=import-outside-toplevel
+
+    media_root = tempfile.mkdtemp(prefix="uploadfile-bench-")
+    backend = (
+        "django.core.files.storage.InMemoryStorage" if storage == "memory"
+        else "django.core.files.storage.FileSystemStorage"
+    )
+    storage_settings = (
+        {"STORAGES": {"default": {"BACKEND": backend}}} if django.VERSION >= (4, 2)
+        else {"DEFAULT_FILE_STORAGE": backend}
+    )
+    settings.configure(
+        SECRET_KEY="uploadfile-bench",
+        MEDIA_ROOT=media_root,
+        MEDIA_URL="/media/",
+        USE_TZ=True,
+        INSTALLED_APPS=[],
+        XBLOCK_SETTINGS={"UploadFileBlock": {}},
+        **storage_settings,
+    )
+    django.setup()
+    return media_root
+
+
+def make_block(user_id="bench", **fields):
+    # pylint: disable=import-outside-toplevel
+    from xblock.fields import ScopeIds
+    from xblock.test.toy_runtime import ToyRuntime
+    from uploadfile import UploadFileBlock
+
+    class BenchRuntime(ToyRuntime):
+        """A stub runtime with predictable handler URLs."""
+
+        def handler_url(self, block, handler_name, suffix='', query='', thirdparty=False):
+            return f"/handler/{handler_name}/{suffix}"
+
+    runtime = BenchRuntime(user_id=user_id)
+    block = runtime.construct_xblock_from_class(
+        UploadFileBlock, ScopeIds(user_id, "uploadfile", "bench-def", f"bench-usage-{user_id}"))
+    for (name, value) in fields.items():
+        setattr(block, name, value)
+    return block
+
+
+class MemoryProbe:
+    """
+    Measures the peak Python allocation (tracemalloc) and, where /proc is
+    available, the peak resident set size above the starting RSS.
+    """
+
+    def __init__(self, interval=0.002):
+        self.interval = interval
+        self.peak_alloc = 0
+        self.peak_rss = 0
+        self._baseline_rss = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def rss():
+        try:
+            with open("/proc/self/statm", encoding="ascii") as statm:
+                return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError, IndexError):
+            return 0
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak_rss = max(self.peak_rss, self.rss() - self._baseline_rss)
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        tracemalloc.start()
+        self._baseline_rss = self.rss()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak_rss = max(self.peak_rss, self.rss() - self._baseline_rss)
+        self.peak_alloc = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return False
+
+
+class MultipartBody:
+    """
+    A file-like multipart/form-data body of `count` files of `size` bytes,
+    generated as it is read so the benchmark itself does not hold the body.
+    """
+
+    BOUNDARY = "uploadfile-bench-boundary"
+
+    def __init__(self, size, count):
+        self.segments = []
+        for index in range(count):
+            head = (
+                f"--{self.BOUNDARY}\r\n"
+                f'Content-Disposition: form-data; name="files[]"; filename="file{index}.pdf"\r\n'
+                "Content-Type: application/pdf\r\n\r\n"
+            ).encode("ascii")
+            self.segments += [("bytes", head), ("fill", size), ("bytes", b"\r\n")]
+        self.segments.append(("bytes", f"--{self.BOUNDARY}--\r\n".encode("ascii")))
+        self.length = sum(len(value) if kind == "bytes" else value for (kind, value) in self.segments)
+        self._filler = b"%PDF" * (16 * 1024)
+
+    @property
+    def content_type(self):
+        return f"multipart/form-data; boundary={self.BOUNDARY}"
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.length
+        out = []
+        while size > 0 and self.segments:
+            (kind, value) = self.segments[0]
+            if kind == "bytes":
+                piece = value[:size]
+                rest = value[size:]
+                self.segments[0] = ("bytes", rest)
+                if not rest:
+                    self.segments.pop(0)
+            else:
+                count = min(size, value, len(self._filler))
+                piece = self._filler[:count]
+                if value - count:
+                    self.segments[0] = ("fill", value - count)
+                else:
+                    self.segments.pop(0)
+            out.append(piece)
+            size -= len(piece)
+        return b"".join(out)
+
+
+def timings(func, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return {
+        "iterations": iterations,
+        "mean_ms": statistics.mean(samples) * 1000,
+        "p50_ms": samples[len(samples) // 2] * 1000,
+        "p95_ms": samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000,
+    }
+
+
+def fake_files(count):
+    return [{
+        "user_filename": f"submission-{index}.pdf",
+        "file_path": f"xblock_uploadfile/bench/{index}",
+        "size": 1000,
+        "content_type": "application/pdf",
+    } for index in range(count)]
+
+
+def bench_student_view(file_counts, iterations):
+    results = []
+    for count in file_counts:
+        block = make_block(file_info_list=fake_files(count), state_version=2, submitted=bool(count))
+        block.student_view()  # warm the template cache
+        results.append(dict(name="student_view", params={"files": count}, **timings(block.student_view, iterations)))
+    return results
+
+
+def bench_refresh_content(file_counts, iterations):
+    from webob import Request  # pylint: disable=import-outside-toplevel
+    results = []
+    for count in file_counts:
+        block = make_block(file_info_list=fake_files(count), state_version=2, submitted=bool(count))
+
+        def refresh(block=block):
+            block.handle("refresh_content", Request.blank("/", method="POST", body=b"{}"))
+        results.append(dict(name="refresh_content", params={"files": count}, **timings(refresh, iterations)))
+
+        # a client that is up to date only gets "not modified"
+        current = json.dumps({"state_etag": block.state_etag()}).encode("utf8")
+
+        def refresh_current(block=block):
+            block.handle("refresh_content", Request.blank("/", method="POST", body=current))
+        results.append(dict(
+            name="refresh_content", params={"files": count, "not_modified": True},
+            **timings(refresh_current, iterations)))
+    return results
+
+
+def bench_stream_upload(sizes_mb, counts):
+    from webob import Request  # pylint: disable=import-outside-toplevel
+    results = []
+    for size_mb in sizes_mb:
+        for count in counts:
+            block = make_block(max_size_mb=size_mb + 1, max_total_size_mb=0)
+            body = MultipartBody(size_mb * MB, count)
+            request = Request.blank("/", method="POST")
+            request.content_type = body.content_type
+            request.body_file = body
+            request.content_length = body.length
+            with MemoryProbe() as probe:
+                start = time.perf_counter()
+                response = block.handle("stream_upload", request)
+                elapsed = time.perf_counter() - start
+            results.append({
+                "name": "stream_upload",
+                "params": {"size_mb": size_mb, "files": count},
+                "status": response.status_code,
+                "seconds": elapsed,
+                "throughput_mb_s": size_mb * count / elapsed,
+                "peak_alloc_bytes": probe.peak_alloc,
+                "peak_rss_bytes": probe.peak_rss,
+            })
+    return results
+
+
+def bench_upload_file(sizes_mb):
+    from webob import Request  # pylint: disable=import-outside-toplevel
+    results = []
+    for size_mb in sizes_mb:
+        block = make_block(max_size_mb=size_mb + 1)
+        payload = json.dumps({
+            "file_data": base64.b64encode(b"%PDF" * (size_mb * MB // 4)).decode("ascii"),
+            "filename": "file.pdf",
+            "file_size": size_mb * MB,
+            "file_type": "application/pdf",
+        }).encode("ascii")
+        request = Request.blank("/", method="POST", body=payload)
+        del payload
+        with MemoryProbe() as probe:
+            start = time.perf_counter()
+            response = block.handle("upload_file", request)
+            elapsed = time.perf_counter() - start
+        results.append({
+            "name": "upload_file",
+            "params": {"size_mb": size_mb},
+            "status": response.status_code,
+            "seconds": elapsed,
+            "throughput_mb_s": size_mb / elapsed,
+            "peak_alloc_bytes": probe.peak_alloc,
+            "peak_rss_bytes": probe.peak_rss,
+        })
+    return results
+
+
+def bench_download_file(sizes_mb):
+    # pylint: disable=import-outside-toplevel
+    from django.core.files.base import ContentFile
+    from django.core.files.storage import default_storage
+    from webob import Request
+    results = []
+    for size_mb in sizes_mb:
+        path = default_storage.save(f"xblock_uploadfile/bench/download-{size_mb}", ContentFile(b"%PDF" * (size_mb * MB // 4)))
+        block = make_block(submitted=True, state_version=2, file_info_list=[{
+            "user_filename": "file.pdf",
+            "file_path": path,
+            "size": size_mb * MB,
+            "content_type": "application/pdf",
+        }])
+        with MemoryProbe() as probe:
+            start = time.perf_counter()
+            response = block.handle("download_file", Request.blank("/"), "0")
+            body = iter(response.app_iter)
+            received = len(next(body, b""))
+            first_byte = time.perf_counter() - start
+            for chunk in body:
+                received += len(chunk)
+            elapsed = time.perf_counter() - start
+            close = getattr(response.app_iter, "close", None)
+            if close:
+                close()
+        results.append({
+            "name": "download_file",
+            "params": {"size_mb": size_mb},
+            "status": response.status_code,
+            "bytes": received,
+            "ttfb_ms": first_byte * 1000,
+            "seconds": elapsed,
+            "throughput_mb_s": size_mb / elapsed,
+            "peak_alloc_bytes": probe.peak_alloc,
+            "peak_rss_bytes": probe.peak_rss,
+        })
+    return results
+
+
+# metrics where a larger value is better, for --compare
+HIGHER_IS_BETTER = {"throughput_mb_s"}
+COMPARED_METRICS = ["mean_ms", "p95_ms", "ttfb_ms", "throughput_mb_s", "peak_alloc_bytes", "peak_rss_bytes"]
+
+
+def compare(previous, current):
+    """Prints the relative change of each metric between two result files."""
+    def key(result):
+        return (result["name"], json.dumps(result["params"], sort_keys=True))
+    baseline = {key(result): result for result in previous["results"]}
+    for result in current["results"]:
+        old = baseline.get(key(result))
+        if old is None:
+            continue
+        for metric in COMPARED_METRICS:
+            if metric not in result or not old.get(metric):
+                continue
+            change = (result[metric] - old[metric]) / old[metric] * 100
+            worse = change < 0 if metric in HIGHER_IS_BETTER else change > 0
+            flag = " (worse)" if worse and abs(change) >= 10 else ""
+            print(f"{result['name']:<16} {json.dumps(result['params']):<32} {metric:<18} "
+                  f"{old[metric]:>14.2f} -> {result[metric]:>14.2f} {change:+7.1f}%{flag}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default="-", help="JSON results file (default: stdout)")
+    parser.add_argument("--compare", help="previous results file to compare with")
+    parser.add_argument("--storage", choices=["filesystem", "memory"], default="filesystem")
+    parser.add_argument("--iterations", type=int, default=200, help="render iterations per case")
+    parser.add_argument("--files", type=int, nargs="+", default=[0, 1, 10, 50], help="file entries for render cases")
+    parser.add_argument("--sizes-mb", type=int, nargs="+", default=[1, 10, 50], help="file sizes for upload/download")
+    parser.add_argument("--counts", type=int, nargs="+", default=[1, 5], help="files per stream_upload request")
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, ROOT)
+    setup_django(args.storage)
+
+    results = []
+    results += bench_student_view(args.files, args.iterations)
+    results += bench_refresh_content(args.files, args.iterations)
+    results += bench_stream_upload(args.sizes_mb, args.counts)
+    results += bench_upload_file(args.sizes_mb)
+    results += bench_download_file(args.sizes_mb)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "storage": args.storage,
+        },
+        "results": results,
+    }
+    encoded = json.dumps(report, indent=2)
+    if args.output == "-":
+        print(encoded)
+    else:
+        with open(args.output, "w", encoding="utf8") as output:
+            output.write(encoded + "\n")
+
+    if args.compare:
+        with open(args.compare, encoding="utf8") as previous:
+            compare(json.load(previous), report)
+
+
+if __name__ == "__main__":
+    main()
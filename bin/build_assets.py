@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+"""
+Builds the static assets that the student view links to by URL.
+
+Writes minified copies of the block's CSS and JS, named by a hash of their
+content, to uploadfile/public/, and a manifest.json that maps each source to
+its copy and records the digest of the source it was built from. Run it
+whenever static/css/uploadfile.css or static/js/uploadfile.js changes:
+
+    python bin/build_assets.py
+
+The JS is minified with rjsmin and the CSS with rcssmin when they are
+installed, and with a conservative built-in minifier otherwise.
+"""
+import hashlib
+import json
+import os
+import re
+import sys
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "uploadfile")
+PUBLIC_DIR = "public"
+MANIFEST = "public/manifest.json"
+ASSETS = [
+    "static/css/uploadfile.css",
+    "static/js/uploadfile.js",
+]
+HASH_LENGTH = 12
+
+
+def minify_css(source):
+    try:
+        import rcssmin  # pylint: disable=import-outside-toplevel
+        return rcssmin.cssmin(source)
+    except ImportError:
+        pass
+    source = re.sub(r"/\*.*?\*/", "", source, flags=re.S)
+    source = re.sub(r"\s+", " ", source)
+    # whitespace around these never changes the meaning of a rule
+    source = re.sub(r"\s*([{};,])\s*", r"\1", source)
+    source = re.sub(r":\s+", ":", source)
+    source = source.replace(";}", "}")
+    return source.strip() + "\n"
+
+
+def minify_js(source):
+    try:
+        import rjsmin  # pylint: disable=import-outside-toplevel
+        return rjsmin.jsmin(source)
+    except ImportError:
+        pass
+    # keep the line structure, so automatic semicolon insertion is unaffected
+    lines = []
+    for line in source.splitlines():
+        line = line.strip()
+        if line and not line.startswith("//"):
+            lines.append(line)
+    return "\n".join(lines) + "\n"
+
+
+MINIFIERS = {
+    ".css": minify_css,
+    ".js": minify_js,
+}
+
+
+def build_asset(path):
+    """Writes the minified copy of the asset at `path` and returns its manifest entry."""
+    with open(os.path.join(PACKAGE_DIR, path), encoding="utf8") as source_file:
+        source = source_file.read()
+    (stem, extension) = os.path.splitext(os.path.basename(path))
+    minified = MINIFIERS[extension](source).encode("utf8")
+    digest = hashlib.sha256(minified).hexdigest()[:HASH_LENGTH]
+    public_path = f"{PUBLIC_DIR}/{stem}.{digest}{extension}"
+    with open(os.path.join(PACKAGE_DIR, public_path), "wb") as public_file:
+        public_file.write(minified)
+    print(f"{path} -> {public_path} ({len(source.encode('utf8'))} -> {len(minified)} bytes)")
+    return {
+        "path": public_path,
+        "source_sha256": hashlib.sha256(source.encode("utf8")).hexdigest(),
+    }
+
+
+def main():
+    os.makedirs(os.path.join(PACKAGE_DIR, PUBLIC_DIR), exist_ok=True)
+    manifest_path = os.path.join(PACKAGE_DIR, MANIFEST)
+    previous = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding="utf8") as manifest_file:
+            previous = json.load(manifest_file)
+
+    manifest = {path: build_asset(path) for path in ASSETS}
+    with open(manifest_path, "w", encoding="utf8") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+        manifest_file.write("\n")
+
+    current = {entry["path"] for entry in manifest.values()}
+    for entry in previous.values():
+        if entry["path"] not in current and os.path.exists(os.path.join(PACKAGE_DIR, entry["path"])):
+            os.remove(os.path.join(PACKAGE_DIR, entry["path"]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -28,11 +28,18 @@ setup(
     description='Upload File XBlock for prompting and uploading files that are stored as responses',
     license='Apache 2.0',
     packages=[
-        'uploadfile'
+        'uploadfile',
+        'uploadfile.management',
+        'uploadfile.management.commands',
+        'uploadfile.migrations',
     ],
     install_requires=[
         'XBlock',
     ],
+    extras_require={
+        'images': ['Pillow'],
+        'pdf': ['pikepdf'],
+    },
     entry_points={
         'xblock.v1': [
             'uploadfile = uploadfile:UploadFileBlock',
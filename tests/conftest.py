@@ -0,0 +1,91 @@
+"""
+Test configuration: a minimal Django setup with filesystem storage and the
+usage index in a temporary directory, and a block on the XBlock toy runtime.
+"""
+import os
+import tempfile
+
+import django
+import pytest
+from django.conf import settings
+
+
+def pytest_configure():
+    if settings.configured:
+        return
+    root = tempfile.mkdtemp(prefix="uploadfile-tests-")
+    settings.configure(
+        SECRET_KEY="uploadfile-tests",
+        MEDIA_ROOT=os.path.join(root, "media"),
+        MEDIA_URL="/media/",
+        USE_TZ=True,
+        INSTALLED_APPS=["uploadfile"],
+        DATABASES={"default": {"ENGINE": "django.db.backends.sqlite3", "NAME": os.path.join(root, "db.sqlite3")}},
+        XBLOCK_SETTINGS={"UploadFileBlock": {}},
+        STORAGES={"default": {"BACKEND": "django.core.files.storage.FileSystemStorage"}},
+    )
+    django.setup()
+    from django.core.management import call_command  # pylint: disable=import-outside-toplevel
+    call_command("migrate", verbosity=0)
+
+
+@pytest.fixture(autouse=True)
+def empty_usage_index():
+    from uploadfile.models import StorageUsage  # pylint: disable=import-outside-toplevel
+    StorageUsage.objects.all().delete()
+
+
+@pytest.fixture
+def storage(tmp_path):
+    from django.core.files.storage import FileSystemStorage  # pylint: disable=import-outside-toplevel
+    return FileSystemStorage(location=str(tmp_path))
+
+
+@pytest.fixture
+def seek_checking_storage(tmp_path):
+    """
+    A filesystem storage that, like django-storages' S3Storage, rewinds the
+    content it saves if the content says it is seekable.
+    """
+    from django.core.files.storage import FileSystemStorage  # pylint: disable=import-outside-toplevel
+
+    class SeekCheckingStorage(FileSystemStorage):
+        def _save(self, name, content):
+            # storages.utils.is_seekable
+            if not hasattr(content, "seekable") or content.seekable():
+                content.seek(0)
+            return super()._save(name, content)
+
+    return SeekCheckingStorage(location=str(tmp_path))
+
+
+@pytest.fixture
+def block_storage(monkeypatch, seek_checking_storage):
+    """Makes blocks store their files in `seek_checking_storage`."""
+    # pylint: disable=import-outside-toplevel
+    from uploadfile import uploadfile
+    from uploadfile.metrics import InstrumentedStorage
+
+    monkeypatch.setattr(uploadfile, "storage", InstrumentedStorage(seek_checking_storage))
+    return seek_checking_storage
+
+
+@pytest.fixture
+def make_block():
+    # pylint: disable=import-outside-toplevel
+    from xblock.fields import ScopeIds
+    from xblock.test.toy_runtime import TOYRUNTIME_KVS, ToyRuntime
+    from uploadfile import UploadFileBlock
+
+    # the toy runtime keeps the fields of all blocks in one global store
+    TOYRUNTIME_KVS.clear()
+
+    def make(user_id="learner", **fields):
+        runtime = ToyRuntime(user_id=user_id)
+        block = runtime.construct_xblock_from_class(
+            UploadFileBlock, ScopeIds(user_id, "uploadfile", "test-def", "test-usage"))
+        for (name, value) in fields.items():
+            setattr(block, name, value)
+        return block
+
+    return make
@@ -0,0 +1,82 @@
+"""Tests of the resumable chunked upload protocol."""
+import json
+
+import pytest
+from webob import Request
+
+from uploadfile import chunks
+
+CHUNK_SIZE = 1000
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(chunks, "CHUNK_SIZE", CHUNK_SIZE)
+
+
+def call(block, handler, data):
+    request = Request.blank("/", method="POST", body=json.dumps(data).encode())
+    response = block.handle(handler, request)
+    return (response.status_code, json.loads(response.body))
+
+
+def send_chunk(block, upload_id, offset, data):
+    response = block.handle("upload_chunk", Request.blank("/", method="PUT", body=data), f"{upload_id}/{offset}")
+    return response.status_code
+
+
+def test_chunked_upload(make_block, block_storage):
+    block = make_block()
+    content = bytes(range(256)) * 10
+    (status, session) = call(block, "upload_init", {
+        "filename": "data.pdf", "file_size": len(content), "file_type": "application/pdf"})
+    assert status == 200
+    assert (session["chunk_size"], session["received"]) == (CHUNK_SIZE, [])
+    upload_id = session["upload_id"]
+
+    # out of order, with the first chunk sent twice
+    for offset in (2000, 0, 0):
+        assert send_chunk(block, upload_id, offset, content[offset:offset + CHUNK_SIZE]) == 200
+    (_status, status_report) = call(block, "upload_status", {"upload_id": upload_id})
+    assert status_report["received"] == [[0, 1000], [2000, 560]]
+    assert status_report["missing"] == [[1000, 2000]]
+    assert call(block, "upload_finalize", {"upload_ids": [upload_id]})[0] == 409
+
+    assert send_chunk(block, upload_id, 1000, content[1000:2000]) == 200
+    (status, result) = call(block, "upload_finalize", {"upload_ids": [upload_id]})
+    assert status == 200
+    [file_info] = block.stored_files()
+    assert file_info["size"] == len(content)
+    with block_storage.open(file_info["file_path"], "rb") as stored:
+        assert stored.read() == content
+    assert block_storage.listdir(chunks.parts_dir(block.runtime.user_id, upload_id))[1] == []
+    assert result["count"] == 1
+
+
+@pytest.mark.parametrize("offset, length", [
+    (500, 1000),   # not at a chunk boundary
+    (0, 999),      # shorter than a chunk
+    (0, 1001),     # longer than a chunk
+    (2000, 1000),  # longer than the last chunk
+    (3000, 1),     # past the end of the file
+])
+def test_chunk_layout_is_enforced(make_block, block_storage, offset, length):
+    block = make_block()
+    upload_id = call(block, "upload_init", {"filename": "a.pdf", "file_size": 2560, "file_type": "application/pdf"})[1]["upload_id"]
+
+    assert send_chunk(block, upload_id, offset, b"x" * length) == 400
+    assert chunks.received_parts(block_storage, block.runtime.user_id, upload_id, 2560, CHUNK_SIZE) == []
+
+
+def test_parts_reader_is_not_seekable(storage, seek_checking_storage):
+    chunks.save_part(storage, "learner", "upload", 0, b"a" * CHUNK_SIZE)
+    chunks.save_part(storage, "learner", "upload", CHUNK_SIZE, b"b" * 10)
+    reader = chunks.PartsReader(storage, "learner", "upload", "a.bin", CHUNK_SIZE + 10, "text/plain", CHUNK_SIZE)
+
+    from django.core.files.base import File  # pylint: disable=import-outside-toplevel
+    path = seek_checking_storage.save("assembled", File(reader, name="a.bin"))
+    reader.close()
+
+    assert not reader.seekable()
+    with seek_checking_storage.open(path, "rb") as assembled:
+        assert assembled.read() == b"a" * CHUNK_SIZE + b"b" * 10
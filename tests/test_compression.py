@@ -0,0 +1,80 @@
+"""Tests of compression at rest."""
+import gzip
+import io
+import os
+
+import pytest
+from django.core.files.base import File
+from django.test import override_settings
+from webob import Request
+
+from uploadfile import compression
+
+from test_multipart import stream_upload
+
+TEXT = b"The quick brown fox jumps over the lazy dog.\n" * 2000
+
+
+@pytest.fixture
+def compress_at_rest():
+    with override_settings(XBLOCK_SETTINGS={"UploadFileBlock": {"COMPRESS_AT_REST": True}}):
+        yield
+
+
+class Unseekable(io.RawIOBase):
+    """A stream that can only be read forward, like a request body."""
+
+    def __init__(self, data):
+        super().__init__()
+        self._data = io.BytesIO(data)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        return self._data.readinto(buffer)
+
+
+def test_compressible_upload_is_stored_compressed(make_block, block_storage, compress_at_rest):
+    block = make_block(file_types=".txt")
+    (status, _result) = stream_upload(block, [("files[]", "notes.txt", "text/plain", TEXT)])
+    assert status == 200
+
+    [file_info] = block.stored_files()
+    assert (file_info["codec"], file_info["size"]) == ("gzip", len(TEXT))
+    with block_storage.open(file_info["file_path"], "rb") as stored:
+        compressed = stored.read()
+    assert len(compressed) < len(TEXT) / 10
+    assert gzip.decompress(compressed) == TEXT
+
+    response = block.handle("download_file", Request.blank("/", headers={"Accept-Encoding": "gzip"}), "0")
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(response.body) == TEXT
+    response = block.handle("download_file", Request.blank("/"), "0")
+    assert "Content-Encoding" not in response.headers
+    assert response.body == TEXT
+
+
+def test_incompressible_type_is_stored_as_is(make_block, block_storage, compress_at_rest):
+    block = make_block(file_types=".jpg")
+    assert stream_upload(block, [("files[]", "photo.jpg", "image/jpeg", TEXT)])[0] == 200
+
+    [file_info] = block.stored_files()
+    assert "codec" not in file_info
+    with block_storage.open(file_info["file_path"], "rb") as stored:
+        assert stored.read() == TEXT
+
+
+@pytest.mark.parametrize("data, codec", [
+    (TEXT, compression.GZIP),
+    (os.urandom(200 * 1024), None),
+], ids=["compressible", "incompressible"])
+def test_unseekable_source_is_saved(seek_checking_storage, data, codec):
+    source = File(Unseekable(data), name="upload.bin")
+    (content, used_codec) = compression.encode(source, "application/octet-stream", 6)
+    assert used_codec == codec
+
+    path = seek_checking_storage.save("saved", content)
+
+    with compression.open_stored(seek_checking_storage, path, used_codec) as stored:
+        assert stored.read() == data
@@ -0,0 +1,131 @@
+"""Tests of direct-to-storage uploads (DIRECT_STORAGE mode)."""
+import json
+import time
+import urllib.parse
+
+import pytest
+from django.test import override_settings
+from webob import Request
+
+from uploadfile import reclaim
+from uploadfile.chunks import UPLOAD_SESSION_TTL
+from uploadfile.signing import S3Signer
+
+
+@pytest.fixture(autouse=True)
+def direct_storage():
+    settings = {"DIRECT_STORAGE": True, "SIGNER": "uploadfile.signing.LocalSigner"}
+    with override_settings(XBLOCK_SETTINGS={"UploadFileBlock": settings}):
+        yield
+
+
+def call(block, handler, data):
+    request = Request.blank("/", method="POST", body=json.dumps(data).encode())
+    response = block.handle(handler, request)
+    return (response.status_code, json.loads(response.body))
+
+
+def presign(block, filename, size):
+    (status, target) = call(block, "presign_upload", {
+        "filename": filename, "file_size": size, "file_type": "application/pdf"})
+    assert status == 200
+    return target
+
+
+def put(block, target, data):
+    suffix = urllib.parse.unquote(target["url"].split("/local_storage/", 1)[1])
+    return block.handle("local_storage", Request.blank("/", method="PUT", body=data), suffix).status_code
+
+
+@pytest.fixture
+def handler_urls(monkeypatch):
+    from xblock.test.toy_runtime import ToyRuntime  # pylint: disable=import-outside-toplevel
+    monkeypatch.setattr(
+        ToyRuntime, "handler_url",
+        lambda self, block, name, suffix="", query="", thirdparty=False: f"/handler/{name}/{suffix}")
+
+
+def test_direct_upload(make_block, block_storage, handler_urls):
+    block = make_block(allow_multiple=True)
+    first = presign(block, "a.pdf", 5)
+    second = presign(block, "b.pdf", 3)
+    assert put(block, first, b"hello") == 200
+    assert put(block, second, b"abc") == 200
+
+    (status, result) = call(block, "confirm_upload", {"upload_tokens": [first["upload_token"], second["upload_token"]]})
+    assert status == 200
+    assert [file_info["user_filename"] for file_info in block.stored_files()] == ["a.pdf", "b.pdf"]
+    assert result["count"] == 2
+
+
+def test_token_can_be_confirmed_once(make_block, block_storage, handler_urls):
+    block = make_block()
+    target = presign(block, "a.pdf", 5)
+    assert put(block, target, b"hello") == 200
+
+    assert call(block, "confirm_upload", {"upload_tokens": [target["upload_token"]] * 2})[0] == 409
+    assert block.stored_files() == []
+
+    target = presign(block, "a.pdf", 5)
+    assert put(block, target, b"hello") == 200
+    assert call(block, "confirm_upload", {"upload_tokens": [target["upload_token"]]})[0] == 200
+    assert call(block, "confirm_upload", {"upload_tokens": [target["upload_token"]]})[0] == 409
+    assert len(block.stored_files()) == 1
+
+
+def test_failed_confirmation_deletes_all_files(make_block, block_storage, handler_urls):
+    block = make_block(allow_multiple=True)
+    good = presign(block, "a.pdf", 5)
+    bad = presign(block, "b.pdf", 5)
+    assert put(block, good, b"hello") == 200
+    assert put(block, bad, b"abc") == 200
+
+    (status, _result) = call(block, "confirm_upload", {"upload_tokens": [good["upload_token"], bad["upload_token"]]})
+
+    assert status == 400
+    assert block.stored_files() == []
+    assert block_storage.listdir(f"xblock_uploadfile/{block.runtime.user_id}")[1] == []
+
+
+def test_upload_larger_than_declared_is_refused(make_block, block_storage, handler_urls):
+    block = make_block()
+    target = presign(block, "a.pdf", 5)
+    assert put(block, target, b"hello, world") == 413
+
+
+def test_expired_uploads_are_journaled(make_block, block_storage, handler_urls):
+    block = make_block()
+    presign(block, "a.pdf", 5)
+    [expired] = block.direct_uploads
+    block.direct_uploads = {expired: time.time() - UPLOAD_SESSION_TTL - 60}
+
+    presign(block, "b.pdf", 5)
+
+    assert expired not in block.direct_uploads
+    [entry] = reclaim.pending_deletions(block_storage)
+    with block_storage.open(f"{reclaim.JOURNAL_ROOT}/{entry}", "rb") as journal_file:
+        assert json.load(journal_file)["file_path"] == expired
+
+
+def test_s3_signer_limits_the_upload_size():
+    class Client:
+        def generate_presigned_post(self, **kwargs):
+            self.kwargs = kwargs
+            return {"url": "https://bucket.s3.amazonaws.com/", "fields": dict(kwargs["Fields"], key=kwargs["Key"])}
+
+    class Storage:
+        bucket_name = "bucket"
+
+        def __init__(self):
+            self.client = Client()
+            self.bucket = type("Bucket", (), {"meta": type("Meta", (), {"client": self.client})})
+
+        def _normalize_name(self, path):
+            return f"media/{path}"
+
+    storage = Storage()
+    target = S3Signer(storage).upload_url(None, "xblock_uploadfile/u/f", "application/pdf", 300, 5)
+
+    assert target["method"] == "POST"
+    assert target["fields"] == {"Content-Type": "application/pdf", "key": "media/xblock_uploadfile/u/f"}
+    assert ["content-length-range", 0, 5] in storage.client.kwargs["Conditions"]
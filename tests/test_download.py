@@ -0,0 +1,73 @@
+"""Tests of download_file: range requests and conditional requests."""
+import pytest
+from webob import Request
+
+from test_multipart import stream_upload
+
+CONTENT = bytes(range(256)) * 40
+
+
+@pytest.fixture
+def block(make_block):
+    block = make_block()
+    assert stream_upload(block, [("files[]", "essay.pdf", "application/pdf", CONTENT)])[0] == 200
+    return block
+
+
+def download(block, **headers):
+    return block.handle("download_file", Request.blank("/", headers=headers), "0")
+
+
+def test_full_download(block):
+    response = download(block)
+    assert response.status_code == 200
+    assert response.body == CONTENT
+    assert response.headers["Accept-Ranges"] == "bytes"
+    assert response.etag and response.last_modified
+
+
+def test_range(block):
+    response = download(block, Range="bytes=100-199")
+    assert response.status_code == 206
+    assert response.headers["Content-Range"] == f"bytes 100-199/{len(CONTENT)}"
+    assert response.body == CONTENT[100:200]
+
+    response = download(block, Range="bytes=-10")
+    assert response.status_code == 206
+    assert response.body == CONTENT[-10:]
+
+
+def test_unsatisfiable_range(block):
+    response = download(block, Range=f"bytes={len(CONTENT)}-")
+    assert response.status_code == 416
+    assert response.headers["Content-Range"] == f"bytes */{len(CONTENT)}"
+
+
+def test_if_range(block):
+    etag = download(block).etag
+    response = download(block, Range="bytes=0-9", **{"If-Range": f'"{etag}"'})
+    assert (response.status_code, response.body) == (206, CONTENT[:10])
+
+    # the client's copy is outdated, so it gets the whole file
+    response = download(block, Range="bytes=0-9", **{"If-Range": '"outdated"'})
+    assert (response.status_code, response.body) == (200, CONTENT)
+
+
+def test_conditional_requests(block):
+    first = download(block)
+
+    response = download(block, **{"If-None-Match": f'"{first.etag}"'})
+    assert response.status_code == 304
+    assert response.body == b""
+    assert download(block, **{"If-None-Match": '"other"'}).status_code == 200
+
+    response = download(block, **{"If-Modified-Since": first.headers["Last-Modified"]})
+    assert response.status_code == 304
+    # If-None-Match takes precedence
+    response = download(block, **{
+        "If-None-Match": '"other"', "If-Modified-Since": first.headers["Last-Modified"]})
+    assert response.status_code == 200
+
+
+def test_missing_index(block):
+    assert block.handle("download_file", Request.blank("/"), "1").status_code == 404
@@ -0,0 +1,145 @@
+"""Tests of the incremental multipart parser and of the stream_upload limits."""
+import io
+import json
+
+import pytest
+from webob import Request
+
+from uploadfile.multipart import MultipartError, MultipartReader, UploadRejected, parse_boundary, spool_part
+
+BOUNDARY = b"----uploadfile-boundary"
+
+
+def multipart_body(parts, boundary=BOUNDARY):
+    """A multipart body of `parts`, a list of (name, filename, content_type, data)."""
+    body = b""
+    for (name, filename, content_type, data) in parts:
+        body += (
+            b"--" + boundary + b"\r\n"
+            + f'Content-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'.encode()
+            + f"Content-Type: {content_type}\r\n\r\n".encode()
+            + data + b"\r\n"
+        )
+    return body + b"--" + boundary + b"--\r\n"
+
+
+def read_all(body, read_size, max_total=None):
+    reader = MultipartReader(io.BytesIO(body), BOUNDARY, max_total=max_total, read_size=read_size)
+    return [(part.filename, part.content_type, b"".join(data)) for (part, data) in reader.parts()]
+
+
+def test_parse_boundary():
+    assert parse_boundary('multipart/form-data; boundary="abc"') == b"abc"
+    assert parse_boundary("multipart/form-data; boundary=abc; charset=utf-8") == b"abc"
+    assert parse_boundary("application/json") is None
+    assert parse_boundary(None) is None
+
+
+@pytest.mark.parametrize("read_size", [1, 2, 3, 7, 16, 25, 64 * 1024])
+def test_boundary_split_across_reads(read_size):
+    # the content contains near-misses of the separator
+    first = b"a\r\n--" + BOUNDARY[:-1] + b"x" * 40
+    second = b"\r\n" * 10 + b"-" * 30
+    body = multipart_body([
+        ("files[]", "a.bin", "application/octet-stream", first),
+        ("files[]", "b.txt", "text/plain", second),
+    ])
+    assert read_all(body, read_size) == [
+        ("a.bin", "application/octet-stream", first),
+        ("b.txt", "text/plain", second),
+    ]
+
+
+def test_filename_path_is_stripped():
+    body = multipart_body([("files[]", "C:\\Users\\me\\essay.pdf", "application/pdf", b"%PDF")])
+    assert read_all(body, 16) == [("essay.pdf", "application/pdf", b"%PDF")]
+
+
+def test_unread_parts_are_drained():
+    body = multipart_body([
+        ("files[]", "skipped.bin", "application/octet-stream", b"s" * 1000),
+        ("files[]", "partial.bin", "application/octet-stream", b"p" * 1000),
+        ("files[]", "read.bin", "application/octet-stream", b"r" * 1000),
+    ])
+    reader = MultipartReader(io.BytesIO(body), BOUNDARY, read_size=100)
+    seen = []
+    for (part, data) in reader.parts():
+        if part.filename == "partial.bin":
+            next(data)
+        elif part.filename == "read.bin":
+            assert b"".join(data) == b"r" * 1000
+        seen.append(part.filename)
+    assert seen == ["skipped.bin", "partial.bin", "read.bin"]
+
+
+def test_truncated_body():
+    body = multipart_body([("files[]", "a.bin", "application/octet-stream", b"x" * 100)])
+    with pytest.raises(MultipartError):
+        read_all(body[:-40], 16)
+
+
+def test_total_size_is_limited_while_reading():
+    body = multipart_body([("files[]", "a.bin", "application/octet-stream", b"x" * 1000)])
+    with pytest.raises(UploadRejected) as rejected:
+        read_all(body, 100, max_total=500)
+    assert rejected.value.status == 413
+    assert rejected.value.details["reason"] == "total_size"
+
+
+def test_file_size_is_limited_while_spooling():
+    body = multipart_body([("files[]", "big.bin", "application/octet-stream", b"x" * 1000)])
+    reader = MultipartReader(io.BytesIO(body), BOUNDARY, read_size=100)
+    (part, data) = next(reader.parts())
+    with pytest.raises(UploadRejected) as rejected:
+        spool_part(part, data, 999)
+    assert rejected.value.status == 413
+    assert rejected.value.details == {
+        "filename": "big.bin", "reason": "file_size", "message": "big.bin is larger than the allowed file size"}
+
+
+def test_spool_part_digest():
+    body = multipart_body([("files[]", "a.txt", "text/plain", b"hello")])
+    reader = MultipartReader(io.BytesIO(body), BOUNDARY)
+    (part, data) = next(reader.parts())
+    upload = spool_part(part, data, None, digest=True)
+    assert (upload.name, upload.size, upload.read()) == ("a.txt", 5, b"hello")
+    assert upload.sha256 == "2cf24dba5fb0a30e26e83b2ac5b9e29e1b161e5c1fa7425e73043362938b9824"
+
+
+def stream_upload(block, parts):
+    request = Request.blank(
+        "/", method="POST", body=multipart_body(parts),
+        content_type=f"multipart/form-data; boundary={BOUNDARY.decode()}")
+    response = block.handle("stream_upload", request)
+    return (response.status_code, json.loads(response.body))
+
+
+def test_stream_upload_rejects_file_type(make_block):
+    block = make_block(file_types=".pdf", allow_multiple=True)
+    (status, result) = stream_upload(block, [
+        ("files[]", "essay.pdf", "application/pdf", b"%PDF"),
+        ("files[]", "notes.exe", "application/octet-stream", b"MZ"),
+    ])
+    assert status == 415
+    assert result["rejected"] == [{
+        "filename": "notes.exe", "reason": "file_type", "message": "notes.exe is not an accepted file type (.pdf)"}]
+    assert block.stored_files() == []
+
+
+def test_stream_upload_rejects_file_size(make_block):
+    block = make_block(max_size_mb=1)
+    (status, result) = stream_upload(block, [("files[]", "big.pdf", "application/pdf", b"x" * (1024 * 1024 + 1))])
+    assert status == 413
+    assert result["rejected"][0]["reason"] == "file_size"
+    assert block.stored_files() == []
+
+
+def test_stream_upload_rejects_total_size(make_block):
+    block = make_block(allow_multiple=True, max_total_size_mb=1)
+    (status, result) = stream_upload(block, [
+        ("files[]", "a.pdf", "application/pdf", b"x" * (600 * 1024)),
+        ("files[]", "b.pdf", "application/pdf", b"x" * (600 * 1024)),
+    ])
+    assert status == 413
+    assert result["rejected"][0]["reason"] == "total_size"
+    assert block.stored_files() == []
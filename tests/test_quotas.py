@@ -0,0 +1,67 @@
+"""Tests of the storage usage index and the learner and block quotas."""
+import json
+
+from django.core.files.storage import default_storage
+from webob import Request
+
+from uploadfile import reclaim, usage
+
+from test_multipart import stream_upload
+
+KB = 1000
+
+
+def upload(block, size):
+    return stream_upload(block, [("files[]", "essay.pdf", "application/pdf", b"x" * size)])
+
+
+def learner_usage(block):
+    return usage.usage(block.course_id(), block.scope_ids.usage_id, block.runtime.user_id)
+
+
+def test_uploads_are_counted_until_swept(make_block):
+    block = make_block()
+    assert upload(block, 600 * KB)[0] == 200
+    assert upload(block, 500 * KB)[0] == 200
+
+    assert learner_usage(block) == {"bytes": 1100 * KB, "files": 2, "pending_bytes": 600 * KB}
+    reclaim.sweep(default_storage, grace_period=0)
+    assert learner_usage(block) == {"bytes": 500 * KB, "files": 1, "pending_bytes": 0}
+
+
+def test_learner_quota(make_block):
+    block = make_block(learner_quota_mb=1)
+    (status, result) = upload(block, 1100 * 1024)
+    assert status == 413
+    assert result["rejected"][0]["reason"] == "learner_quota"
+    assert learner_usage(block)["bytes"] == 0
+
+
+def test_replacing_files_is_within_the_learner_quota(make_block):
+    block = make_block(learner_quota_mb=1)
+    for _attempt in range(3):
+        assert upload(block, 600 * KB)[0] == 200
+    assert learner_usage(block)["bytes"] == 1800 * KB
+
+
+def test_block_quota_counts_replaced_files(make_block):
+    first = make_block("first", block_quota_mb=2)
+    second = make_block("second", block_quota_mb=2)
+    assert upload(first, 900 * KB)[0] == 200
+    assert upload(first, 900 * KB)[0] == 200
+
+    (status, result) = upload(second, 900 * KB)
+    assert status == 413
+    assert result["rejected"][0]["reason"] == "block_quota"
+
+    reclaim.sweep(default_storage, grace_period=0)
+    assert upload(second, 900 * KB)[0] == 200
+
+
+def test_chunked_upload_is_checked_at_init(make_block):
+    block = make_block(learner_quota_mb=1)
+    request = Request.blank("/", method="POST", body=json.dumps({
+        "filename": "essay.pdf", "file_size": 1100 * 1024, "file_type": "application/pdf"}).encode())
+    response = block.handle("upload_init", request)
+    assert response.status_code == 413
+    assert block.upload_sessions == {}
@@ -0,0 +1,160 @@
+"""Tests of the pending-deletion sweeper and of reconciliation."""
+import os
+import time
+
+import pytest
+from django.core.files.base import ContentFile
+
+from uploadfile import blobs, chunks, reclaim
+from uploadfile.processing import OPTIMIZED, THUMBNAIL, variant_path
+
+DAY = 24 * 60 * 60
+
+
+def store(storage, path, data=b"data", age=0):
+    storage.save(path, ContentFile(data))
+    if age:
+        modified = time.time() - age
+        os.utime(storage.path(path), (modified, modified))
+    return path
+
+
+def journal(storage, monkeypatch, file_info, age=0):
+    """Journals `file_info` as if it had been queued `age` seconds ago."""
+    queued_at = time.time() - age
+    with monkeypatch.context() as patch:
+        patch.setattr(reclaim.time, "time", lambda: queued_at)
+        reclaim.journal_deletion(storage, file_info, "learner", "usage", "course")
+
+
+def test_sweep_respects_grace_period(storage, monkeypatch):
+    old = store(storage, "xblock_uploadfile/learner/old")
+    new = store(storage, "xblock_uploadfile/learner/new")
+    journal(storage, monkeypatch, {"file_path": old, "size": 4}, age=2 * DAY)
+    journal(storage, monkeypatch, {"file_path": new, "size": 4}, age=60)
+
+    stats = reclaim.sweep(storage, grace_period=DAY)
+
+    assert stats == {"processed": 1, "deleted": 1, "kept": 0, "failed": 0, "abandoned_uploads": 0}
+    assert not storage.exists(old)
+    assert storage.exists(new)
+    assert len(reclaim.pending_deletions(storage)) == 1
+
+
+def test_sweep_max_entries(storage, monkeypatch):
+    for name in ("a", "b", "c"):
+        journal(storage, monkeypatch, {"file_path": store(storage, f"xblock_uploadfile/learner/{name}")}, age=DAY)
+
+    assert reclaim.sweep(storage, grace_period=0, max_entries=2)["processed"] == 2
+    assert len(reclaim.pending_deletions(storage)) == 1
+
+
+def test_sweep_keeps_referenced_blobs(storage, monkeypatch):
+    digest = "ab" * 32
+    path = store(storage, blobs.blob_path(digest))
+    kept_ref = blobs.add_ref(storage, digest, "learner", "usage")
+    released_ref = blobs.add_ref(storage, digest, "other", "usage")
+    blobs.release_ref(storage, digest, released_ref)
+    journal(storage, monkeypatch, {"file_path": path, "sha256": digest}, age=DAY)
+
+    assert reclaim.sweep(storage, grace_period=0)["kept"] == 1
+    assert storage.exists(path)
+    # the entry is dropped; releasing the last reference journals the blob again
+    assert reclaim.pending_deletions(storage) == []
+
+    blobs.release_ref(storage, digest, kept_ref)
+    journal(storage, monkeypatch, {"file_path": path, "sha256": digest}, age=DAY)
+    assert reclaim.sweep(storage, grace_period=0)["deleted"] == 1
+    assert not storage.exists(path)
+
+
+def test_sweep_deletes_variants(storage, monkeypatch):
+    path = store(storage, "xblock_uploadfile/learner/photo")
+    variants = [store(storage, variant_path(path, variant)) for variant in (OPTIMIZED, THUMBNAIL)]
+    journal(storage, monkeypatch, {"file_path": path}, age=DAY)
+
+    assert reclaim.sweep(storage, grace_period=0)["deleted"] == 1
+    assert not any(storage.exists(name) for name in [path] + variants)
+
+
+def test_sweep_dry_run(storage, monkeypatch):
+    path = store(storage, "xblock_uploadfile/learner/photo")
+    thumbnail = store(storage, variant_path(path, THUMBNAIL))
+    journal(storage, monkeypatch, {"file_path": path}, age=DAY)
+
+    stats = reclaim.sweep(storage, grace_period=0, dry_run=True)
+
+    assert stats["deleted"] == 1
+    assert storage.exists(path) and storage.exists(thumbnail)
+    assert len(reclaim.pending_deletions(storage)) == 1
+
+
+def test_sweep_deletes_abandoned_upload_parts(storage):
+    chunks.save_part(storage, "learner", "abandoned", 0, b"abc")
+    chunks.save_part(storage, "learner", "active", 0, b"abc")
+    modified = time.time() - chunks.UPLOAD_SESSION_TTL - 60
+    for name in storage.listdir(chunks.parts_dir("learner", "abandoned"))[1]:
+        os.utime(storage.path(f"{chunks.parts_dir('learner', 'abandoned')}/{name}"), (modified, modified))
+
+    assert reclaim.sweep(storage, dry_run=True)["abandoned_uploads"] == 1
+    assert chunks.received_parts(storage, "learner", "abandoned", 3, chunks.CHUNK_SIZE) == [(0, 3)]
+
+    assert reclaim.sweep(storage)["abandoned_uploads"] == 1
+    assert chunks.received_parts(storage, "learner", "abandoned", 3, chunks.CHUNK_SIZE) == []
+    assert chunks.received_parts(storage, "learner", "active", 3, chunks.CHUNK_SIZE) == [(0, 3)]
+
+
+@pytest.fixture
+def stored_files(storage):
+    return {
+        "referenced": store(storage, "xblock_uploadfile/learner/referenced", age=3 * DAY),
+        "referenced_variant": store(storage, "xblock_uploadfile/learner/referenced.thumbnail", age=3 * DAY),
+        "orphan": store(storage, "xblock_uploadfile/learner/orphan", age=3 * DAY),
+        "orphan_variant": store(storage, "xblock_uploadfile/learner/orphan.optimized", age=3 * DAY),
+        # a direct upload that can still be confirmed
+        "unconfirmed": store(storage, "xblock_uploadfile/learner/unconfirmed", age=DAY + 60),
+        "recent": store(storage, "xblock_uploadfile/learner/recent"),
+        "part": store(storage, f"{chunks.parts_dir('learner', 'upload')}/{chunks.part_name(0)}", age=3 * DAY),
+    }
+
+
+def test_reconcile(storage, stored_files):
+    orphans = reclaim.reconcile(storage, [stored_files["referenced"]], min_age=DAY)
+
+    assert sorted(orphans) == sorted([stored_files["orphan"], stored_files["orphan_variant"]])
+    assert len(reclaim.pending_deletions(storage)) == 2
+    # journal entries are internal, so they are never orphaned themselves
+    assert sorted(reclaim.reconcile(storage, [stored_files["referenced"]], min_age=DAY)) == sorted(orphans)
+
+
+def test_reconcile_min_age(storage, stored_files):
+    orphans = reclaim.reconcile(storage, [stored_files["referenced"]], min_age=4 * DAY, dry_run=True)
+    assert orphans == []
+
+
+def test_reconcile_leaves_uploads_that_can_be_confirmed(storage, stored_files):
+    orphans = reclaim.reconcile(storage, [stored_files["referenced"]], min_age=0, dry_run=True)
+    assert stored_files["unconfirmed"] not in orphans
+    assert stored_files["recent"] not in orphans
+
+
+def test_reconcile_dry_run(storage, stored_files):
+    orphans = reclaim.reconcile(storage, [stored_files["referenced"]], min_age=DAY, dry_run=True)
+    assert len(orphans) == 2
+    assert reclaim.pending_deletions(storage) == []
+
+
+def test_reconcile_blobs(storage):
+    referenced = "cd" * 32
+    orphaned = "ef" * 32
+    store(storage, blobs.blob_path(referenced), age=DAY + 60)
+    store(storage, blobs.blob_path(orphaned), age=DAY + 60)
+    store(storage, variant_path(blobs.blob_path(orphaned), THUMBNAIL), age=DAY + 60)
+    blobs.add_ref(storage, referenced, "learner", "usage")
+
+    orphans = reclaim.reconcile(storage, [], min_age=DAY)
+
+    assert sorted(orphans) == sorted([blobs.blob_path(orphaned), variant_path(blobs.blob_path(orphaned), THUMBNAIL)])
+    reclaim.sweep(storage, grace_period=0)
+    assert storage.exists(blobs.blob_path(referenced))
+    assert not storage.exists(blobs.blob_path(orphaned))
@@ -0,0 +1,61 @@
+"""Tests of the versioned learner state and the upgrade of version 1 state."""
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from webob import Request
+
+from uploadfile import reclaim
+from uploadfile.state import STATE_VERSION, compact_file_info, learner_files, upgrade_files
+
+from test_multipart import stream_upload
+
+V1_ENTRY = {
+    "filename": "xblock_uploadfile/learner/old",
+    "user_filename": "old.pdf",
+    "file_url": "https://lms.example.com/handler/download_file/0",
+    "size": 3,
+    "content_type": "application/pdf",
+}
+
+
+def test_compact_file_info():
+    assert compact_file_info(V1_ENTRY) == {
+        "user_filename": "old.pdf",
+        "file_path": "xblock_uploadfile/learner/old",
+        "size": 3,
+        "content_type": "application/pdf",
+    }
+
+
+def test_upgrade_files():
+    assert upgrade_files([V1_ENTRY], {}) == [compact_file_info(V1_ENTRY)]
+    # a single file in the legacy file_info dict
+    assert upgrade_files([], V1_ENTRY) == [compact_file_info(V1_ENTRY)]
+    assert upgrade_files([], {}) == []
+
+
+def test_learner_files():
+    assert learner_files({"file_info_list": [V1_ENTRY]}) == [compact_file_info(V1_ENTRY)]
+    assert learner_files({"file_info": V1_ENTRY}) == [compact_file_info(V1_ENTRY)]
+    current = [compact_file_info(V1_ENTRY)]
+    assert learner_files({"state_version": STATE_VERSION, "file_info_list": current}) == current
+
+
+def test_version_1_state_is_read_and_rewritten(make_block):
+    default_storage.save(V1_ENTRY["filename"], ContentFile(b"old"))
+    block = make_block(file_info=V1_ENTRY, submitted=True)
+
+    assert block.stored_files() == [compact_file_info(V1_ENTRY)]
+    response = block.handle("download_file", Request.blank("/"), "0")
+    assert (response.status_code, response.body) == (200, b"old")
+    assert "old.pdf" in block.render_file_html()[0]
+
+    assert stream_upload(block, [("files[]", "new.pdf", "application/pdf", b"new")])[0] == 200
+
+    assert block.state_version == STATE_VERSION
+    assert block.file_info == {}
+    [file_info] = block.file_info_list
+    assert file_info["user_filename"] == "new.pdf"
+    assert "file_url" not in file_info
+    # the legacy file is queued for deletion
+    reclaim.sweep(default_storage, grace_period=0)
+    assert not default_storage.exists(V1_ENTRY["filename"])
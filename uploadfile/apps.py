@@ -0,0 +1,8 @@
+"""Django app of the UploadFile XBlock, for its management command and usage index."""
+from django.apps import AppConfig
+
+
+class UploadFileConfig(AppConfig):
+    name = "uploadfile"
+    verbose_name = "Upload File XBlock"
+    default_auto_field = "django.db.models.BigAutoField"
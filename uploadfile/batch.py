@@ -0,0 +1,46 @@
+"""
+Bounded parallel execution for batches of storage writes.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+
+class UploadBatchError(Exception):
+    """
+    Some files of a batch could not be stored. `errors` holds the details of
+    each failed file.
+    """
+
+    def __init__(self, errors, total):
+        super().__init__(f"{len(errors)} of {total} files could not be stored")
+        self.errors = errors
+
+
+def run_batch(func, items, concurrency):
+    """
+    Calls `func` on each item using up to `concurrency` threads and returns a
+    list of (result, exception) pairs in the order of `items`, whatever order
+    the calls complete in.
+    """
+    items = list(items)
+    if concurrency is None or concurrency <= 1 or len(items) <= 1:
+        outcomes = []
+        for item in items:
+            try:
+                outcomes.append((func(item), None))
+            except Exception as e:  # pylint: disable=broad-except
+                outcomes.append((None, e))
+        return outcomes
+
+    outcomes = []
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(items)),
+                            thread_name_prefix="uploadfile") as executor:
+        futures = [executor.submit(func, item) for item in items]
+        for future in futures:
+            try:
+                outcomes.append((future.result(), None))
+            except Exception as e:  # pylint: disable=broad-except
+                outcomes.append((None, e))
+    return outcomes
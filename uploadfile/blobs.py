@@ -0,0 +1,118 @@
+"""
+Content-addressed storage of submissions.
+
+When CONTENT_ADDRESSED_STORAGE is enabled, files are stored once per
+distinct content under their SHA-256 digest, so the same file uploaded by
+many learners or to many blocks is only written once. Every file info
+entry that points to a blob holds a reference, recorded as a small marker
+object under `refs/{digest}/`. The number of markers is the blob's
+reference count.
+"""
+import hashlib
+import io
+import json
+import logging
+import tempfile
+import uuid
+
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import UploadedFile
+
+log = logging.getLogger(__name__)
+
+BLOB_ROOT = "xblock_uploadfile/blobs"
+REFS_ROOT = "xblock_uploadfile/refs"
+READ_SIZE = 64 * 1024
+SPOOL_MEMORY_SIZE = 1024 * 1024
+
+
+def blob_path(digest):
+    return f"{BLOB_ROOT}/{digest[:2]}/{digest}"
+
+
+def refs_dir(digest):
+    return f"{REFS_ROOT}/{digest}"
+
+
+def _rewind(file):
+    try:
+        file.seek(0)
+        return True
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return False
+
+
+def content_hash(file):
+    """
+    Returns (digest, source) where digest is the SHA-256 of the file content
+    and source is a readable file positioned at its start. Digests computed
+    while the upload was received are reused. A file that cannot be rewound
+    is copied to a temporary file in the same pass; the caller must close
+    `source` when it is not `file`.
+    """
+    digest = getattr(file, "sha256", None)
+    if digest:
+        return (digest, file)
+    hasher = hashlib.sha256()
+    if _rewind(file):
+        for chunk in iter(lambda: file.read(READ_SIZE), b""):
+            hasher.update(chunk)
+        file.seek(0)
+        return (hasher.hexdigest(), file)
+    spooled = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_SIZE)
+    size = 0
+    for chunk in iter(lambda: file.read(READ_SIZE), b""):
+        hasher.update(chunk)
+        spooled.write(chunk)
+        size += len(chunk)
+    spooled.seek(0)
+    source = UploadedFile(spooled, name=file.name, content_type=getattr(file, "content_type", None), size=size)
+    return (hasher.hexdigest(), source)
+
+
+def store_blob(storage, file, digest):
+    """
+    Stores the content of `file` as the blob for `digest` unless it is already
+    stored. Returns (path, written).
+    """
+    path = blob_path(digest)
+    if storage.exists(path):
+        return (path, False)
+    saved = storage.save(path, file)
+    if saved != path:
+        # another request stored the same content meanwhile
+        storage.delete(saved)
+        return (path, False)
+    return (path, True)
+
+
+def add_ref(storage, digest, user_id, usage_id):
+    """Records a reference to a blob and returns its id."""
+    ref = uuid.uuid4().hex
+    marker = json.dumps({"user_id": str(user_id), "usage_id": str(usage_id)}).encode("utf8")
+    storage.save(f"{refs_dir(digest)}/{ref}", ContentFile(marker))
+    return ref
+
+
+def release_ref(storage, digest, ref):
+    """
+    Removes a reference to a blob. Blobs are not deleted here, because another
+    request may be adding a reference at the same time; unreferenced blobs are
+    reclaimed by the garbage collector.
+    """
+    try:
+        storage.delete(f"{refs_dir(digest)}/{ref}")
+    except Exception as e:  # pylint: disable=broad-except
+        log.warning("Failed to release reference %s to blob %s: %s", ref, digest, e)
+
+
+def list_refs(storage, digest):
+    try:
+        (_dirs, files) = storage.listdir(refs_dir(digest))
+    except (FileNotFoundError, NotADirectoryError):
+        return []
+    return files
+
+
+def ref_count(storage, digest):
+    return len(list_refs(storage, digest))
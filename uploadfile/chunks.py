@@ -0,0 +1,159 @@
+"""
+Storage helpers for the resumable chunked upload protocol.
+
+Each chunk of an upload session is written to storage as its own part,
+named after its byte offset, under a per-session prefix. Chunks start at
+multiples of the session's chunk size and only the last one is shorter, so
+the length of a part follows from its offset and a retried chunk replaces
+the earlier attempt. Parts can arrive in any order and in parallel, and the
+set of received parts is recovered by listing the prefix, so resuming an
+upload does not depend on any per-request state. On finalize the parts are
+read back in order and streamed into the final file.
+"""
+import io
+import logging
+import posixpath
+
+from django.core.files.base import ContentFile
+
+log = logging.getLogger(__name__)
+
+CHUNK_SIZE = 4 * 1024 * 1024
+# upload sessions that have not been finalized within this time are discarded
+UPLOAD_SESSION_TTL = 2 * 24 * 60 * 60
+
+
+class IncompleteUpload(Exception):
+    """The parts received so far do not cover the whole file."""
+
+
+def parts_dir(user_id, upload_id):
+    return f"xblock_uploadfile/{user_id}/.parts/{upload_id}"
+
+
+def part_name(offset):
+    # zero padded so that a plain listing sorts by offset
+    return f"{offset:015d}"
+
+
+def parse_part_name(name):
+    return int(name) if name.isdigit() else None
+
+
+def part_length(offset, size, chunk_size):
+    """The length of the chunk at `offset`, or None if no chunk starts there."""
+    if offset < 0 or offset >= size or offset % chunk_size:
+        return None
+    return min(chunk_size, size - offset)
+
+
+def save_part(storage, user_id, upload_id, offset, data):
+    """Stores one chunk, replacing a previous attempt at the same offset."""
+    path = posixpath.join(parts_dir(user_id, upload_id), part_name(offset))
+    if storage.exists(path):
+        storage.delete(path)
+    return storage.save(path, ContentFile(data))
+
+
+def _part_names(storage, user_id, upload_id):
+    try:
+        (_dirs, files) = storage.listdir(parts_dir(user_id, upload_id))
+    except (FileNotFoundError, NotADirectoryError):
+        return []
+    return files
+
+
+def received_parts(storage, user_id, upload_id, size, chunk_size):
+    """Returns the sorted list of (offset, length) parts stored so far."""
+    parts = []
+    for name in _part_names(storage, user_id, upload_id):
+        offset = parse_part_name(name)
+        length = part_length(offset, size, chunk_size) if offset is not None else None
+        if length is not None:
+            parts.append((offset, length))
+    return sorted(parts)
+
+
+def missing_ranges(parts, size):
+    """Returns the [start, stop) byte ranges that no part covers."""
+    missing = []
+    position = 0
+    for (offset, length) in parts:
+        if offset > position:
+            missing.append([position, offset])
+        position = max(position, offset + length)
+    if position < size:
+        missing.append([position, size])
+    return missing
+
+
+def ordered_parts(parts, size):
+    """
+    Returns the chain of parts that covers [0, size) exactly.
+    """
+    by_offset = dict(parts)
+    chain = []
+    position = 0
+    while position < size:
+        length = by_offset.get(position)
+        if not length:
+            raise IncompleteUpload(f"missing bytes from offset {position}")
+        chain.append((position, length))
+        position += length
+    if position != size:
+        raise IncompleteUpload(f"parts cover {position} bytes, expected {size}")
+    return chain
+
+
+def delete_parts(storage, user_id, upload_id):
+    for name in _part_names(storage, user_id, upload_id):
+        path = posixpath.join(parts_dir(user_id, upload_id), name)
+        try:
+            storage.delete(path)
+        except Exception as e:  # pylint: disable=broad-except
+            log.warning("Failed to delete upload part %s: %s", path, e)
+
+
+class PartsReader(io.RawIOBase):
+    """
+    A read-only, non-seekable file-like object that streams the parts of an
+    upload session in order, so the final file can be saved without
+    assembling it in memory. It carries the `name`, `size` and `content_type`
+    of the uploaded file, like an uploaded file object does.
+    """
+
+    def __init__(self, storage, user_id, upload_id, name, size, content_type, chunk_size):
+        super().__init__()
+        self.storage = storage
+        self.name = name
+        self.size = size
+        self.content_type = content_type
+        parts = received_parts(storage, user_id, upload_id, size, chunk_size)
+        self._paths = [
+            posixpath.join(parts_dir(user_id, upload_id), part_name(offset))
+            for (offset, _length) in ordered_parts(parts, size)
+        ]
+        self._index = 0
+        self._current = None
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while self._index < len(self._paths):
+            if self._current is None:
+                self._current = self.storage.open(self._paths[self._index], "rb")
+            data = self._current.read(len(buffer))
+            if data:
+                buffer[:len(data)] = data
+                return len(data)
+            self._current.close()
+            self._current = None
+            self._index += 1
+        return 0
+
+    def close(self):
+        if self._current is not None:
+            self._current.close()
+            self._current = None
+        super().close()
@@ -0,0 +1,165 @@
+"""
+Compressed-at-rest storage of uploads.
+
+With COMPRESS_AT_REST, uploads of compressible content are gzip compressed
+while they are streamed to storage, and their file info records
+`codec: "gzip"`. Content types that are compressed already (JPEG, PNG, ZIP,
+office documents, ...) are stored as they are, and so is any file whose first
+chunk does not shrink by at least MIN_SAVING.
+
+Downloads of compressed files are sent as stored, with
+`Content-Encoding: gzip`, to clients that accept it, and decompressed on the
+fly for the others. Other readers of stored files go through `open_stored`.
+"""
+import gzip
+import io
+import zlib
+
+from django.core.files.base import File
+
+GZIP = "gzip"
+READ_SIZE = 64 * 1024
+# a file is only compressed if its first chunk shrinks by at least this fraction
+MIN_SAVING = 0.1
+
+INCOMPRESSIBLE_TYPES = frozenset([
+    "image/jpeg",
+    "image/png",
+    "image/gif",
+    "image/webp",
+    "image/avif",
+    "image/heic",
+    "application/zip",
+    "application/gzip",
+    "application/x-gzip",
+    "application/x-bzip2",
+    "application/x-xz",
+    "application/x-7z-compressed",
+    "application/x-rar-compressed",
+    "application/vnd.rar",
+    "application/epub+zip",
+])
+INCOMPRESSIBLE_PREFIXES = (
+    "video/",
+    "audio/",
+    # OOXML and OpenDocument files are ZIP archives
+    "application/vnd.openxmlformats-officedocument.",
+    "application/vnd.oasis.opendocument.",
+)
+
+
+def is_compressible(content_type):
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    return content_type not in INCOMPRESSIBLE_TYPES and not content_type.startswith(INCOMPRESSIBLE_PREFIXES)
+
+
+class GzipReader(io.RawIOBase):
+    """
+    A read-only, non-seekable file-like object that gzip compresses `source`
+    as it is read, so a file can be compressed while it is being saved.
+    `head` is data already read from the start of `source`.
+    """
+
+    def __init__(self, source, level, head=b""):
+        super().__init__()
+        self.source = source
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        self._head = head
+        self._buffer = b""
+        self._done = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = len(buffer)
+        while len(self._buffer) < size and not self._done:
+            data = self._head or self.source.read(READ_SIZE)
+            self._head = b""
+            if data:
+                self._buffer += self._compressor.compress(data)
+            else:
+                self._buffer += self._compressor.flush()
+                self._done = True
+        (data, self._buffer) = (self._buffer[:size], self._buffer[size:])
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        try:
+            self.source.close()
+        finally:
+            super().close()
+
+
+class _HeadReader(io.RawIOBase):
+    """Reads `head` and then the rest of `source`, for sources that cannot seek."""
+
+    def __init__(self, source, head):
+        super().__init__()
+        self.source = source
+        self._head = head
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = len(buffer)
+        if self._head:
+            (data, self._head) = (self._head[:size], self._head[size:])
+        else:
+            data = self.source.read(size)
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        try:
+            self.source.close()
+        finally:
+            super().close()
+
+
+def encode(file, content_type, level):
+    """
+    Returns (content, codec): the content to save in place of the uploaded
+    `file`, and the codec it is encoded with, or None if it is stored as is.
+    """
+    if not is_compressible(content_type):
+        return (file, None)
+    head = file.read(READ_SIZE)
+    if head and len(zlib.compress(head, 1)) <= len(head) * (1 - MIN_SAVING):
+        return (File(GzipReader(file, level, head), name=file.name), GZIP)
+    try:
+        file.seek(0)
+        return (file, None)
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return (File(_HeadReader(file, head), name=file.name), None)
+
+
+class GunzipReader(gzip.GzipFile):
+    """Decompresses a stored gzip file as it is read, and closes it with itself."""
+
+    def __init__(self, source):
+        super().__init__(fileobj=source, mode="rb")
+        self._source = source
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self._source.close()
+
+
+def decoder(codec):
+    """Returns a function that wraps a stored file of `codec` to read its original bytes."""
+    if codec == GZIP:
+        return GunzipReader
+    raise ValueError(f"Unknown codec {codec}")
+
+
+def open_stored(storage, file_path, codec=None):
+    """Opens a stored file for reading its original bytes."""
+    source = storage.open(file_path, "rb")
+    if codec is None:
+        return source
+    return decoder(codec)(source)
@@ -0,0 +1,53 @@
+"""
+Deployment settings for the UploadFile XBlock.
+
+Settings are read from the `UploadFileBlock` entry of the Django
+`XBLOCK_SETTINGS` dict, for example::
+
+    XBLOCK_SETTINGS = {
+        "UploadFileBlock": {
+            "STORAGE_CONCURRENCY": 8,
+        }
+    }
+"""
+from django.conf import settings
+
+SETTINGS_KEY = "UploadFileBlock"
+
+DEFAULTS = {
+    # number of files of a batch upload that are written to storage in parallel
+    "STORAGE_CONCURRENCY": 4,
+    # store files once per distinct content, under their SHA-256 digest
+    "CONTENT_ADDRESSED_STORAGE": False,
+    # upload and download through signed storage URLs instead of the LMS
+    "DIRECT_STORAGE": False,
+    # dotted path of the uploadfile.signing.Signer used in DIRECT_STORAGE mode
+    "SIGNER": "uploadfile.signing.S3Signer",
+    # lifetime of signed URLs, in seconds
+    "SIGNED_URL_EXPIRY": 300,
+    # where measurements go: "null", "log", "statsd" or the dotted path of a sink class
+    "METRICS_SINK": "null",
+    "METRICS_STATSD_HOST": "127.0.0.1",
+    "METRICS_STATSD_PORT": 8125,
+    # seconds a superseded file is kept before the sweeper may delete it
+    "DELETION_GRACE_PERIOD": 24 * 60 * 60,
+    # optimize images and PDFs and make thumbnails after upload, see uploadfile.processing
+    "POST_PROCESSING": False,
+    # processes of the post-processing pool
+    "PROCESSING_WORKERS": 2,
+    # images larger than this (in pixels) are downscaled in the optimized variant
+    "IMAGE_MAX_DIMENSION": 2048,
+    "IMAGE_QUALITY": 85,
+    "THUMBNAIL_SIZE": 200,
+    # also make a linearized, recompressed variant of PDFs
+    "OPTIMIZE_PDF": True,
+    # gzip compressible uploads in storage, see uploadfile.compression
+    "COMPRESS_AT_REST": False,
+    "COMPRESSION_LEVEL": 6,
+}
+
+
+def get_setting(name):
+    """Returns the configured value of `name`, or its default."""
+    block_settings = getattr(settings, "XBLOCK_SETTINGS", {}).get(SETTINGS_KEY, {})
+    return block_settings.get(name, DEFAULTS.get(name))
@@ -0,0 +1,197 @@
+"""
+Streaming download support for the UploadFile XBlock.
+
+Stored files are sent as a WSGI `app_iter` that reads bounded chunks from
+storage, so the memory used per download does not depend on the file size.
+Single byte ranges (`206 Partial Content`) and conditional GETs using
+ETag / Last-Modified validators are supported. Files stored with a content
+encoding are sent encoded to clients that accept it and decoded otherwise.
+"""
+import datetime
+import hashlib
+import io
+import logging
+import urllib
+
+from webob import Response
+
+log = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+
+class StorageFileIter:
+    """
+    A WSGI app_iter that streams bytes [start, stop) of a stored file in
+    bounded chunks. `opener` is called lazily so the file is only opened
+    when the server starts sending the body.
+    """
+
+    def __init__(self, opener, start=0, stop=None, chunk_size=CHUNK_SIZE):
+        self.opener = opener
+        self.start = start
+        self.stop = stop
+        self.chunk_size = chunk_size
+        self._file = None
+
+    def _seek(self, file, offset):
+        try:
+            file.seek(offset)
+            return
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            pass
+        # not seekable: skip forward in bounded reads
+        while offset > 0:
+            skipped = file.read(min(self.chunk_size, offset))
+            if not skipped:
+                break
+            offset -= len(skipped)
+
+    def __iter__(self):
+        self._file = self.opener()
+        try:
+            if self.start:
+                self._seek(self._file, self.start)
+            remaining = None if self.stop is None else self.stop - self.start
+            while remaining is None or remaining > 0:
+                size = self.chunk_size if remaining is None else min(self.chunk_size, remaining)
+                chunk = self._file.read(size)
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            finally:
+                self._file = None
+
+
+def storage_metadata(storage, file_path):
+    """
+    Returns (size, last_modified) for a stored file. Backends that cannot
+    report a modification time give None for it.
+    """
+    size = storage.size(file_path)
+    try:
+        last_modified = storage.get_modified_time(file_path)
+    except (NotImplementedError, AttributeError, OSError):
+        last_modified = None
+    if last_modified is not None and last_modified.tzinfo is None:
+        last_modified = last_modified.replace(tzinfo=datetime.timezone.utc)
+    return (size, last_modified)
+
+
+def make_etag(file_path, size, last_modified):
+    """
+    Stored files are written under unique names and never modified in place,
+    so the path, size and modification time identify the content.
+    """
+    stamp = last_modified.isoformat() if last_modified is not None else ""
+    return hashlib.sha1(f"{file_path}:{size}:{stamp}".encode("utf8")).hexdigest()
+
+
+def content_disposition(user_filename):
+    encoded_filename = urllib.parse.quote(user_filename)
+    return f'attachment; filename="{user_filename}"; filename*=UTF-8\'\'{encoded_filename}'
+
+
+def is_not_modified(request, etag, last_modified):
+    if request.headers.get("If-None-Match"):
+        # If-None-Match takes precedence over If-Modified-Since (RFC 7232)
+        return etag in request.if_none_match
+    if_modified_since = request.if_modified_since
+    if if_modified_since is not None and last_modified is not None:
+        return last_modified.replace(microsecond=0) <= if_modified_since
+    return False
+
+
+def _file_response(request, etag, last_modified, content_type, user_filename):
+    """
+    The response for a stored file with its validators and headers set, or a
+    304 response if the client's copy is current.
+    """
+    response = Response(content_type=content_type, conditional_response=False)
+    response.etag = etag
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.headers['Content-Disposition'] = content_disposition(user_filename)
+    # private files: allow the browser to keep a copy, but always revalidate
+    response.headers['Cache-Control'] = 'private, no-cache'
+
+    if is_not_modified(request, etag, last_modified):
+        response.status = 304
+        response.app_iter = []
+        response.content_length = None
+    return response
+
+
+def streaming_response(request, opener, size, etag, last_modified,
+                       content_type, user_filename, chunk_size=CHUNK_SIZE):
+    """
+    Builds a streaming WebOb response for a stored file, answering
+    conditional requests with 304 and range requests with 206/416.
+    """
+    response = _file_response(request, etag, last_modified, content_type, user_filename)
+    response.headers['Accept-Ranges'] = 'bytes'
+    if response.status_code == 304:
+        return response
+
+    start, stop = 0, size
+    byte_range = request.range
+    if byte_range is not None and response in request.if_range:
+        requested = byte_range.range_for_length(size)
+        if requested is None:
+            response.status = 416
+            response.app_iter = []
+            response.content_length = 0
+            response.headers['Content-Range'] = f"bytes */{size}"
+            return response
+        (start, stop) = requested
+        response.status = 206
+        response.content_range = (start, stop, size)
+
+    response.app_iter = StorageFileIter(opener, start, stop, chunk_size)
+    response.content_length = stop - start
+    log.debug('streaming_response: %s bytes %s-%s of %s', user_filename, start, stop, size)
+    return response
+
+
+def accepts_encoding(request, encoding):
+    # without an Accept-Encoding header, only the identity encoding is safe
+    return "Accept-Encoding" in request.headers and bool(request.accept_encoding.acceptable_offers([encoding]))
+
+
+def encoded_response(request, opener, size, etag, last_modified, content_type,
+                     user_filename, encoding, decoder, chunk_size=CHUNK_SIZE):
+    """
+    Builds a streaming WebOb response for a stored file of `size` bytes that
+    is encoded with `encoding`. Clients that accept the encoding get the
+    stored bytes with a Content-Encoding header; for the others they are
+    wrapped with `decoder` and sent without a Content-Length. Range requests
+    are answered with the whole file.
+    """
+    encoded = accepts_encoding(request, encoding)
+    if encoded:
+        # the representations differ, and so must their validators
+        etag = f"{etag}-{encoding}"
+    response = _file_response(request, etag, last_modified, content_type, user_filename)
+    response.headers['Accept-Ranges'] = 'none'
+    response.vary = ('Accept-Encoding',)
+    if response.status_code == 304:
+        return response
+
+    if encoded:
+        response.content_encoding = encoding
+        response.app_iter = StorageFileIter(opener, chunk_size=chunk_size)
+        response.content_length = size
+    else:
+        response.app_iter = StorageFileIter(lambda: decoder(opener()), chunk_size=chunk_size)
+        response.content_length = None
+    log.debug('encoded_response: %s (%s, %s)', user_filename, encoding, "as stored" if encoded else "decoded")
+    return response
@@ -0,0 +1,134 @@
+"""
+Streaming ZIP export of the files submitted to an UploadFile block.
+
+The archive is produced by a generator: each stored file is copied into the
+ZIP in bounded chunks and the archive bytes are handed to the WSGI server
+as soon as they are written, so memory use does not grow with the number or
+size of the submissions.
+"""
+import csv
+import datetime
+import logging
+import re
+import tempfile
+import zipfile
+
+from .compression import open_stored
+
+log = logging.getLogger(__name__)
+
+READ_SIZE = 64 * 1024
+MANIFEST_NAME = "manifest.csv"
+MANIFEST_FIELDS = ["username", "user_filename", "archive_name", "size", "content_type", "status"]
+
+
+def iter_learner_states(usage_key):
+    """
+    Returns an iterator of (username, state) for every learner that has state
+    for the block, using the LMS user state client. Raises ImportError outside
+    of the LMS.
+    """
+    # pylint: disable=import-error,import-outside-toplevel
+    from lms.djangoapps.courseware.user_state_client import DjangoXBlockUserStateClient
+    return (
+        (user_state.username, user_state.state)
+        for user_state in DjangoXBlockUserStateClient().iter_all_for_block(usage_key)
+    )
+
+
+def safe_name(name):
+    """Makes a user supplied name safe to use as a single archive path segment."""
+    name = re.sub(r"[\\/\x00-\x1f]", "_", name or "").strip(" .")
+    return name or "file"
+
+
+class _StreamSink:
+    """
+    A write-only, non seekable file for zipfile that keeps what was written
+    until it is drained.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_zip(storage, submissions, manifest=False):
+    """
+    Yields the bytes of a ZIP archive of `submissions`, an iterable of
+    (username, file_info_list). Entries are named
+    `{username}/{index}_{user_filename}`. With `manifest`, a CSV listing every
+    entry is added at the end of the archive.
+    """
+    sink = _StreamSink()
+    rows = tempfile.SpooledTemporaryFile(max_size=READ_SIZE, mode="w+", newline="") if manifest else None
+    writer = csv.DictWriter(rows, fieldnames=MANIFEST_FIELDS) if manifest else None
+    if writer is not None:
+        writer.writeheader()
+    try:
+        with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+            for (username, file_info_list) in submissions:
+                for (index, file_info) in enumerate(file_info_list):
+                    user_filename = file_info.get("user_filename", "download.bin")
+                    archive_name = f"{safe_name(username)}/{index}_{safe_name(user_filename)}"
+                    status = "ok"
+                    try:
+                        yield from _write_entry(archive, sink, storage, file_info, archive_name)
+                    except FileNotFoundError:
+                        log.warning("export: missing file %s for %s", file_info.get("file_path"), username)
+                        status = "missing"
+                    if writer is not None:
+                        writer.writerow({
+                            "username": username,
+                            "user_filename": user_filename,
+                            "archive_name": archive_name if status == "ok" else "",
+                            "size": file_info.get("size", ""),
+                            "content_type": file_info.get("content_type", ""),
+                            "status": status,
+                        })
+            if rows is not None:
+                rows.seek(0)
+                with archive.open(_zip_info(MANIFEST_NAME), "w") as dest:
+                    for line in iter(lambda: rows.read(READ_SIZE), ""):
+                        dest.write(line.encode("utf8"))
+                        yield sink.drain()
+        # closing the archive writes the central directory
+        yield sink.drain()
+    finally:
+        if rows is not None:
+            rows.close()
+
+
+def _zip_info(name):
+    info = zipfile.ZipInfo(name, date_time=datetime.datetime.now().timetuple()[:6])
+    info.compress_type = zipfile.ZIP_STORED
+    return info
+
+
+def _write_entry(archive, sink, storage, file_info, archive_name):
+    file_path = file_info["file_path"]
+    if not storage.exists(file_path):
+        raise FileNotFoundError(file_path)
+    with open_stored(storage, file_path, file_info.get("codec")) as source:
+        # zip64 headers, since sizes are not known up front in a stream
+        with archive.open(_zip_info(archive_name), "w", force_zip64=True) as dest:
+            for chunk in iter(lambda: source.read(READ_SIZE), b""):
+                dest.write(chunk)
+                yield sink.drain()
+    yield sink.drain()
@@ -0,0 +1,50 @@
+"""
+Deletes stored upload files that are no longer referenced.
+
+    ./manage.py lms uploadfile_gc                 # sweep the pending-deletion journal and abandoned uploads
+    ./manage.py lms uploadfile_gc --reconcile     # also journal files no learner state references
+"""
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+
+from uploadfile.config import get_setting
+from uploadfile.reclaim import reconcile, referenced_paths_from_lms, sweep
+
+
+class Command(BaseCommand):
+    help = "Deletes superseded and orphaned UploadFile XBlock files from storage"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--reconcile", action="store_true",
+            help="First compare storage with learner state and journal unreferenced files")
+        parser.add_argument(
+            "--grace-period", type=int, default=get_setting("DELETION_GRACE_PERIOD"),
+            help="Only delete files queued (or, when reconciling, modified) at least this many seconds ago")
+        parser.add_argument("--batch-size", type=int, default=100, help="Journal entries per batch")
+        parser.add_argument("--rate", type=float, default=None, help="Maximum journal entries per second")
+        parser.add_argument("--max-entries", type=int, default=None, help="Stop after this many journal entries")
+        parser.add_argument("--dry-run", action="store_true", help="Report without deleting anything")
+
+    def handle(self, *args, **options):
+        if options["reconcile"]:
+            try:
+                referenced = referenced_paths_from_lms()
+                orphans = reconcile(
+                    default_storage, referenced, min_age=options["grace_period"], dry_run=options["dry_run"])
+            except ImportError as e:
+                raise CommandError("Reconciliation needs the LMS courseware models") from e
+            self.stdout.write(f"reconcile: {len(orphans)} orphaned files")
+            if options["dry_run"]:
+                for path in orphans:
+                    self.stdout.write(f"  {path}")
+
+        stats = sweep(
+            default_storage,
+            grace_period=options["grace_period"],
+            batch_size=options["batch_size"],
+            rate=options["rate"],
+            max_entries=options["max_entries"],
+            dry_run=options["dry_run"],
+        )
+        self.stdout.write("sweep: " + ", ".join(f"{key}={value}" for (key, value) in stats.items()))
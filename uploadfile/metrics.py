@@ -0,0 +1,172 @@
+"""
+Instrumentation for the UploadFile XBlock.
+
+Handlers and storage calls report timers, counters and histograms through a
+pluggable sink, chosen with the METRICS_SINK setting:
+
+* `"null"` (default) discards everything.
+* `"log"` writes one structured (JSON) log line per measurement to the
+  `uploadfile.metrics` logger.
+* `"statsd"` sends DogStatsD-style UDP datagrams to METRICS_STATSD_HOST and
+  METRICS_STATSD_PORT, which a statsd agent or a Prometheus statsd exporter
+  can collect. Any local UDP listener can stand in for the agent.
+* any other value is the dotted path of a sink class.
+"""
+import functools
+import json
+import logging
+import socket
+import time
+from contextlib import contextmanager
+
+from django.utils.module_loading import import_string
+
+from .config import get_setting
+
+log = logging.getLogger(__name__)
+metrics_log = logging.getLogger("uploadfile.metrics")
+
+PREFIX = "uploadfile"
+
+
+class NullSink:
+    """Discards all measurements."""
+
+    def emit(self, kind, name, value, tags):
+        pass
+
+
+class LogSink:
+    """Writes each measurement as a JSON log line."""
+
+    def emit(self, kind, name, value, tags):
+        metrics_log.info(json.dumps({"metric": name, "type": kind, "value": value, "tags": tags}, sort_keys=True))
+
+
+class StatsdSink:
+    """Sends measurements as DogStatsD UDP datagrams, dropping them on error."""
+
+    TYPES = {"counter": "c", "timer": "ms", "histogram": "h"}
+
+    def __init__(self, host=None, port=None):
+        self.address = (host or get_setting("METRICS_STATSD_HOST"), port or get_setting("METRICS_STATSD_PORT"))
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setblocking(False)
+
+    @staticmethod
+    def format(kind, name, value, tags):
+        if kind == "timer":
+            value = value * 1000
+        # byte counts must not lose digits to an exponent
+        value = str(int(value)) if isinstance(value, int) else f"{value:.6f}".rstrip("0").rstrip(".")
+        line = f"{name}:{value}|{StatsdSink.TYPES[kind]}"
+        if tags:
+            line += "|#" + ",".join(f"{key}:{tag}" for (key, tag) in sorted(tags.items()))
+        return line
+
+    def emit(self, kind, name, value, tags):
+        try:
+            self.socket.sendto(self.format(kind, name, value, tags).encode("utf8"), self.address)
+        except OSError as e:
+            log.debug("Dropped metric %s: %s", name, e)
+
+
+SINKS = {
+    "null": NullSink,
+    "log": LogSink,
+    "statsd": StatsdSink,
+}
+
+
+class Metrics:
+    """Records measurements, prefixing their names with `uploadfile.`."""
+
+    def __init__(self, sink):
+        self.sink = sink
+
+    def incr(self, name, value=1, **tags):
+        self.sink.emit("counter", f"{PREFIX}.{name}", value, tags)
+
+    def histogram(self, name, value, **tags):
+        self.sink.emit("histogram", f"{PREFIX}.{name}", value, tags)
+
+    def timing(self, name, seconds, **tags):
+        self.sink.emit("timer", f"{PREFIX}.{name}", seconds, tags)
+
+    @contextmanager
+    def timer(self, name, **tags):
+        """Times the block, tagging whether it raised."""
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            yield
+            outcome = "ok"
+        finally:
+            self.timing(name, time.perf_counter() - start, outcome=outcome, **tags)
+
+
+_METRICS = {}
+
+
+def get_metrics():
+    """Returns the Metrics for the configured sink, created once per process."""
+    name = get_setting("METRICS_SINK")
+    metrics = _METRICS.get(name)
+    if metrics is None:
+        sink_class = SINKS.get(name) or import_string(name)
+        metrics = Metrics(sink_class())
+        _METRICS[name] = metrics
+    return metrics
+
+
+def instrumented(handler_name):
+    """
+    Decorates an XBlock handler to time it and count its responses by status.
+    Apply it below `XBlock.handler` / `XBlock.json_handler`.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            metrics = get_metrics()
+            start = time.perf_counter()
+            status = 500
+            try:
+                result = func(*args, **kwargs)
+                status = getattr(result, "status_code", 200)
+                return result
+            except Exception as e:
+                status = getattr(e, "status_code", 500)
+                raise
+            finally:
+                elapsed = time.perf_counter() - start
+                metrics.timing("handler.duration", elapsed, handler=handler_name, status=status)
+                metrics.incr("handler.requests", handler=handler_name, status=status)
+        return wrapper
+    return decorator
+
+
+class InstrumentedStorage:
+    """
+    Wraps a Django storage to time its calls. Other attributes are passed
+    through unchanged.
+    """
+
+    TIMED = frozenset(["save", "open", "url", "exists", "delete", "size", "listdir", "get_modified_time"])
+
+    def __init__(self, storage):
+        self._storage = storage
+
+    @property
+    def backend(self):
+        wrapped = getattr(self._storage, "_wrapped", self._storage)
+        return type(wrapped).__name__
+
+    def __getattr__(self, name):
+        attr = getattr(self._storage, name)
+        if name not in self.TIMED or not callable(attr):
+            return attr
+
+        def timed(*args, **kwargs):
+            with get_metrics().timer("storage.call", operation=name, backend=self.backend):
+                return attr(*args, **kwargs)
+        return timed
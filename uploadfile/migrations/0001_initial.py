@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StorageUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('course_id', models.CharField(max_length=255)),
+                ('usage_id', models.CharField(blank=True, max_length=255)),
+                ('user_id', models.CharField(blank=True, max_length=255)),
+                ('bytes', models.BigIntegerField(default=0)),
+                ('files', models.IntegerField(default=0)),
+                ('pending_bytes', models.BigIntegerField(default=0)),
+                ('modified', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('course_id', 'usage_id', 'user_id'), name='uploadfile_usage_key')],
+            },
+        ),
+    ]
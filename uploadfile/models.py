@@ -0,0 +1,28 @@
+"""Database models of the UploadFile XBlock, used when `uploadfile` is an installed app."""
+from django.db import models
+
+
+class StorageUsage(models.Model):
+    """
+    The bytes and files stored through UploadFile blocks. There is a row per
+    learner and block, a row per block (with an empty `user_id`) and a row per
+    course (with an empty `usage_id` and `user_id`), see uploadfile.usage.
+    """
+
+    course_id = models.CharField(max_length=255)
+    usage_id = models.CharField(max_length=255, blank=True)
+    user_id = models.CharField(max_length=255, blank=True)
+    bytes = models.BigIntegerField(default=0)
+    files = models.IntegerField(default=0)
+    # bytes of replaced files that the sweeper has not reclaimed yet, included in `bytes`
+    pending_bytes = models.BigIntegerField(default=0)
+    modified = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        app_label = "uploadfile"
+        constraints = [
+            models.UniqueConstraint(fields=["course_id", "usage_id", "user_id"], name="uploadfile_usage_key"),
+        ]
+
+    def __str__(self):
+        return f"{self.course_id} {self.usage_id} {self.user_id}: {self.bytes} bytes in {self.files} files"
@@ -0,0 +1,177 @@
+"""
+An incremental multipart/form-data parser for the stream_upload handler.
+
+The request body is read in bounded blocks and each file part is spooled
+to a temporary file as it arrives, so size and type limits are enforced
+while bytes are still being received instead of after the whole body has
+been buffered.
+"""
+import email.message
+import email.utils
+import hashlib
+import logging
+import re
+import tempfile
+
+from django.core.files.uploadedfile import UploadedFile
+
+log = logging.getLogger(__name__)
+
+READ_SIZE = 64 * 1024
+MAX_HEADER_SIZE = 16 * 1024
+# uploads smaller than this stay in memory while they are spooled
+SPOOL_MEMORY_SIZE = 1024 * 1024
+
+_BOUNDARY_RE = re.compile(r'boundary="?([^";]+)"?', re.IGNORECASE)
+
+
+class MultipartError(Exception):
+    """The request body is not valid multipart/form-data."""
+
+
+class UploadRejected(Exception):
+    """
+    An upload limit was crossed. `status` is the HTTP status to answer with
+    and `details` describes the rejected file.
+    """
+
+    def __init__(self, status, reason, message, filename=None):
+        super().__init__(message)
+        self.status = status
+        self.details = {"filename": filename, "reason": reason, "message": message}
+
+
+def parse_boundary(content_type):
+    if not content_type or not content_type.lower().startswith("multipart/form-data"):
+        return None
+    match = _BOUNDARY_RE.search(content_type)
+    return match.group(1).encode("latin-1") if match else None
+
+
+class Part:
+    """The headers of one part of a multipart body."""
+
+    def __init__(self, raw_headers):
+        message = email.message.Message()
+        for line in raw_headers.decode("utf8", "replace").split("\r\n"):
+            if ":" in line:
+                (name, value) = line.split(":", 1)
+                message[name.strip()] = value.strip()
+        self.headers = message
+        self.name = self._param("name")
+        filename = self._param("filename")
+        # some browsers send the full client side path
+        self.filename = re.split(r"[\\/]", filename)[-1] if filename is not None else None
+        self.content_type = message.get_content_type() if message.get("Content-Type") else "application/octet-stream"
+
+    def _param(self, name):
+        value = self.headers.get_param(name, header="content-disposition")
+        if value is None:
+            return None
+        return email.utils.collapse_rfc2231_value(value)
+
+
+class MultipartReader:
+    """
+    Reads a multipart body from `stream` in bounded blocks. `parts()` yields
+    (Part, data) pairs where data is an iterator over the part's bytes; it
+    must be consumed (or is skipped) before the next part is read.
+    `max_total` limits the number of body bytes read.
+    """
+
+    def __init__(self, stream, boundary, max_total=None, read_size=READ_SIZE):
+        self.stream = stream
+        self.delimiter = b"--" + boundary
+        self.max_total = max_total
+        self.read_size = read_size
+        self.total = 0
+        self._buffer = b""
+        self._eof = False
+
+    def _fill(self):
+        if self._eof:
+            raise MultipartError("Unexpected end of request body")
+        data = self.stream.read(self.read_size)
+        if not data:
+            self._eof = True
+            return
+        self.total += len(data)
+        if self.max_total is not None and self.total > self.max_total:
+            raise UploadRejected(413, "total_size", "The upload is larger than the allowed total size")
+        self._buffer += data
+
+    def _skip_to(self, marker):
+        while True:
+            index = self._buffer.find(marker)
+            if index >= 0:
+                self._buffer = self._buffer[index + len(marker):]
+                return
+            self._buffer = self._buffer[-(len(marker) - 1):]
+            self._fill()
+
+    def _ensure(self, size):
+        while len(self._buffer) < size:
+            self._fill()
+
+    def _data(self):
+        separator = b"\r\n" + self.delimiter
+        while True:
+            index = self._buffer.find(separator)
+            if index >= 0:
+                if index:
+                    yield self._buffer[:index]
+                self._buffer = self._buffer[index + len(separator):]
+                return
+            # keep enough to recognise a separator split across reads
+            safe = len(self._buffer) - len(separator) + 1
+            if safe > 0:
+                yield self._buffer[:safe]
+                self._buffer = self._buffer[safe:]
+            self._fill()
+
+    def parts(self):
+        self._skip_to(self.delimiter)
+        while True:
+            self._ensure(2)
+            if self._buffer.startswith(b"--"):
+                return
+            self._skip_to(b"\r\n")
+            while b"\r\n\r\n" not in self._buffer:
+                if len(self._buffer) > MAX_HEADER_SIZE:
+                    raise MultipartError("Part headers too large")
+                self._fill()
+            (raw_headers, self._buffer) = self._buffer.split(b"\r\n\r\n", 1)
+            data = self._data()
+            yield (Part(raw_headers), data)
+            for _chunk in data:
+                # drain whatever the consumer did not read
+                pass
+
+
+def spool_part(part, data, max_size, digest=False):
+    """
+    Copies the bytes of a file part into a temporary file, rejecting it as
+    soon as it grows past `max_size`. Returns a Django UploadedFile. With
+    `digest`, the SHA-256 of the content is computed in the same pass and
+    set as its `sha256` attribute.
+    """
+    spooled = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_SIZE)
+    hasher = hashlib.sha256() if digest else None
+    size = 0
+    try:
+        for chunk in data:
+            size += len(chunk)
+            if max_size is not None and size > max_size:
+                raise UploadRejected(
+                    413, "file_size", f"{part.filename} is larger than the allowed file size", part.filename)
+            spooled.write(chunk)
+            if hasher is not None:
+                hasher.update(chunk)
+        spooled.seek(0)
+    except Exception:
+        spooled.close()
+        raise
+    upload = UploadedFile(spooled, name=part.filename, content_type=part.content_type, size=size)
+    if hasher is not None:
+        upload.sha256 = hasher.hexdigest()
+    return upload
@@ -0,0 +1,267 @@
+"""
+Post-upload processing of images and PDFs.
+
+With POST_PROCESSING, every upload that has been recorded is handed to a
+process pool, so the work adds nothing to the upload latency. The workers
+derive variants of the file and store them next to the original, at
+`{file_path}.{variant}`:
+
+* `optimized`: an image downscaled to fit IMAGE_MAX_DIMENSION and re-encoded,
+  or a linearized PDF with compressed streams. It is only kept when it is
+  smaller than the original.
+* `thumbnail`: a JPEG preview of an image that fits THUMBNAIL_SIZE.
+
+Images need Pillow and PDFs need pikepdf (the `images` and `pdf` extras).
+Without them, no variants are produced for those files. The variants a file
+can get are recorded as `pending_variants` in its file info when it is queued.
+The block moves them to `variants` once it finds them stored, and gives up on
+those that are not stored within PROCESSING_TIMEOUT, e.g. because the file is
+not a valid image or a worker died. Only recorded variants are linked, and
+until an optimized variant is stored, a request for it is served the original.
+"""
+import functools
+import io
+import logging
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.core.files.base import File
+from django.core.files.storage import default_storage
+from django.utils.functional import empty
+
+from .compression import open_stored
+from .config import get_setting
+from .metrics import get_metrics
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+try:
+    import pikepdf
+except ImportError:
+    pikepdf = None
+
+log = logging.getLogger(__name__)
+
+ORIGINAL = "original"
+OPTIMIZED = "optimized"
+THUMBNAIL = "thumbnail"
+VARIANTS = (OPTIMIZED, THUMBNAIL)
+
+# content types of the images that are processed, with their Pillow format
+IMAGE_FORMATS = {
+    "image/jpeg": "JPEG",
+    "image/png": "PNG",
+    "image/webp": "WEBP",
+}
+PDF_TYPE = "application/pdf"
+READ_SIZE = 64 * 1024
+# pending variants that are not stored this long after the upload are given up on
+PROCESSING_TIMEOUT = 15 * 60
+
+
+def variant_path(file_path, variant):
+    return f"{file_path}.{variant}"
+
+
+def split_variant(path):
+    """Returns (file_path, variant) for a stored path; variant is None for an original."""
+    (file_path, _, suffix) = path.rpartition(".")
+    if file_path and suffix in VARIANTS:
+        return (file_path, suffix)
+    return (path, None)
+
+
+def planned_variants(content_type):
+    """The variants that processing produces for files of `content_type`."""
+    if not get_setting("POST_PROCESSING"):
+        return []
+    if content_type in IMAGE_FORMATS and Image is not None:
+        return [OPTIMIZED, THUMBNAIL]
+    if content_type == PDF_TYPE and pikepdf is not None and get_setting("OPTIMIZE_PDF"):
+        return [OPTIMIZED]
+    return []
+
+
+def resolve_variants(storage, file_info, now):
+    """
+    Moves the pending variants of `file_info` that have been stored to its
+    `variants`, and drops the overdue ones. Returns True if it changed.
+    """
+    pending = file_info.get("pending_variants")
+    if not pending:
+        return False
+    stored = [variant for variant in pending if storage.exists(variant_path(file_info["file_path"], variant))]
+    if stored:
+        file_info["variants"] = list(file_info.get("variants", ())) + stored
+    pending = [variant for variant in pending if variant not in stored]
+    if pending and now - file_info.get("queued_at", 0) <= PROCESSING_TIMEOUT:
+        file_info["pending_variants"] = pending
+        return bool(stored)
+    file_info.pop("pending_variants", None)
+    file_info.pop("queued_at", None)
+    return True
+
+
+def variant_content_type(content_type, variant):
+    return "image/jpeg" if variant == THUMBNAIL else content_type
+
+
+def variant_filename(user_filename, variant):
+    if variant == THUMBNAIL:
+        return f"{user_filename.rpartition('.')[0] or user_filename}-thumbnail.jpg"
+    return user_filename
+
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+def _init_worker():
+    # pylint: disable=import-outside-toplevel
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        # spawned workers have to load the Django settings themselves
+        django.setup()
+    # forked workers must not share the parent's storage connections
+    default_storage._wrapped = empty  # pylint: disable=protected-access
+
+
+def get_pool():
+    """Returns the processing pool, created on first use."""
+    global _POOL  # pylint: disable=global-statement
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = ProcessPoolExecutor(max_workers=get_setting("PROCESSING_WORKERS"), initializer=_init_worker)
+        return _POOL
+
+
+def _discard_pool(pool):
+    global _POOL  # pylint: disable=global-statement
+    with _POOL_LOCK:
+        if _POOL is pool:
+            _POOL = None
+    pool.shutdown(wait=False)
+
+
+def schedule(file_info):
+    """Queues the pending variants of a stored file for processing."""
+    variants = file_info.get("pending_variants")
+    if not variants:
+        return None
+    options = {
+        "max_dimension": get_setting("IMAGE_MAX_DIMENSION"),
+        "quality": get_setting("IMAGE_QUALITY"),
+        "thumbnail_size": get_setting("THUMBNAIL_SIZE"),
+    }
+    pool = get_pool()
+    try:
+        future = pool.submit(
+            process_file, file_info["file_path"], file_info["content_type"], variants, options, file_info.get("codec"))
+    except BrokenProcessPool as e:
+        # a worker died; the next upload starts a new pool
+        log.error("Processing pool is broken, %s is not processed: %s", file_info["file_path"], e)
+        _discard_pool(pool)
+        return None
+    future.add_done_callback(functools.partial(_processed, file_info["file_path"], time.perf_counter()))
+    return future
+
+
+def _processed(file_path, started, future):
+    metrics = get_metrics()
+    error = future.exception()
+    outcome = "ok" if error is None else "error"
+    metrics.timing("processing.duration", time.perf_counter() - started, outcome=outcome)
+    if error is not None:
+        log.error("Failed to process %s: %s", file_path, error)
+        return
+    for variant in future.result():
+        metrics.incr("processing.variants", variant=variant)
+
+
+def process_file(file_path, content_type, variants, options, codec=None):
+    """
+    Runs in a pool worker: stores the missing `variants` of the file at
+    `file_path`, which is encoded with `codec`. Returns the variants that were
+    stored.
+    """
+    variants = [variant for variant in variants if not default_storage.exists(variant_path(file_path, variant))]
+    if not variants:
+        # e.g. a content-addressed blob that was processed before
+        return []
+    with tempfile.TemporaryFile() as original:
+        with open_stored(default_storage, file_path, codec) as source:
+            shutil.copyfileobj(source, original, READ_SIZE)
+        original_size = original.tell()
+        original.seek(0)
+        if content_type == PDF_TYPE:
+            outputs = {OPTIMIZED: _optimize_pdf(original)}
+        else:
+            outputs = _process_image(original, IMAGE_FORMATS[content_type], variants, options)
+
+    stored = []
+    for (variant, output) in outputs.items():
+        with output:
+            size = output.seek(0, io.SEEK_END)
+            if variant == OPTIMIZED and size >= original_size:
+                continue
+            output.seek(0)
+            path = variant_path(file_path, variant)
+            default_storage.save(path, File(output, name=path))
+            stored.append(variant)
+    return stored
+
+
+def _process_image(original, image_format, variants, options):
+    max_dimension = options["max_dimension"]
+    outputs = {}
+    with Image.open(original) as image:
+        if image_format == "JPEG":
+            # let the decoder downscale, so a large photo is never fully decoded
+            image.draft("RGB", (max_dimension, max_dimension))
+        # apply the EXIF orientation, as the metadata is not kept
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+        if OPTIMIZED in variants:
+            outputs[OPTIMIZED] = _encode(image, image_format, options["quality"])
+        if THUMBNAIL in variants:
+            thumbnail_size = options["thumbnail_size"]
+            image.thumbnail((thumbnail_size, thumbnail_size), Image.LANCZOS)
+            outputs[THUMBNAIL] = _encode(image, "JPEG", options["quality"])
+    return outputs
+
+
+def _encode(image, image_format, quality):
+    output = io.BytesIO()
+    if image_format == "JPEG":
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        image.save(output, "JPEG", quality=quality, optimize=True, progressive=True)
+    elif image_format == "PNG":
+        image.save(output, "PNG", optimize=True)
+    else:
+        image.save(output, image_format, quality=quality)
+    return output
+
+
+def _optimize_pdf(original):
+    output = tempfile.TemporaryFile()
+    try:
+        with pikepdf.open(original) as pdf:
+            pdf.save(
+                output,
+                linearize=True,
+                compress_streams=True,
+                object_stream_mode=pikepdf.ObjectStreamMode.generate,
+            )
+    except Exception:
+        output.close()
+        raise
+    return output
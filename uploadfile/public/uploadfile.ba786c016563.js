@@ -0,0 +1,285 @@
+function UploadFileXBlock(runtime, element) {
+var dropZone = $("#uploadfile-drop-zone", element);
+var fileInput = $("#uploadfile-input", element);
+var uploadBtn = $("#uploadfile-btn", element);
+var statusDiv = $("#uploadfile-status", element);
+var selectedFiles = null;
+var maxSizeMb = parseInt($(".uploadfile-xblock", element).data('max-size-mb'));
+var directUpload = $(".uploadfile-xblock", element).data('direct-upload') === true;
+var content = {
+file_html: dropZone.find("#drop-zone-text").html(),
+file_subtext: dropZone.find("#drop-zone-subtext").text(),
+instructions: dropZone.find("#instructions").text(),
+state_etag: $(".uploadfile-xblock", element).attr('data-state-etag'),
+};
+uploadBtn.hide();
+dropZone.on("click", function (e) {
+if (e.target !== fileInput[0] && e.target.tagName !== "A") fileInput.click();
+});
+function showStatus(status) {
+console.log('status', status);
+statusDiv.text(status);
+}
+function showContent(response, status) {
+if (!response.not_modified) {
+const { file_html, file_subtext, instructions, state_etag } = response;
+content = { file_html, file_subtext, instructions, state_etag };
+}
+dropZone.find("#drop-zone-text").html(content.file_html);
+dropZone.find("#drop-zone-subtext").text(content.file_subtext);
+dropZone.find("#instructions").text(content.instructions);
+uploadBtn.hide();
+showStatus(status);
+}
+function refresh(status) {
+$.ajax({
+type: "POST",
+url: runtime.handlerUrl(element, "refresh_content"),
+contentType: "application/json; charset=utf-8",
+data: JSON.stringify({ state_etag: content.state_etag }),
+success: function (response) {
+showContent(response, status);
+},
+});
+}
+function filesSelected(files) {
+selectedFiles = files;
+const selectFilesArray = Array.from(selectedFiles);
+const warnings = [];
+for (const file of selectFilesArray) {
+if (file.size > maxSizeMb * 1024 * 1024) {
+warnings.push(file.name);
+}
+}
+if (warnings.length) {
+const warningStatus = `These files are too big: ${warnings.join(", ")}`;
+showStatus(warningStatus);
+}
+if (selectFilesArray && selectFilesArray.length > 0) {
+const names = selectFilesArray.map((o) => o.name).join(", ");
+uploadBtn.show();
+dropZone.find("#drop-zone-text").text(names);
+dropZone.find("#drop-zone-subtext").text("Files uploaded:");
+} else {
+uploadBtn.hide();
+dropZone.find("#drop-zone-text").text("");
+dropZone.find("#drop-zone-subtext").text("");
+}
+}
+fileInput.on("change", function (e) {
+showStatus("");
+if (e.target.files.length > 0) {
+filesSelected(e.target.files);
+} else {
+filesSelected(null);
+}
+});
+dropZone.on("dragover", function (e) {
+e.preventDefault();
+e.stopPropagation();
+dropZone.addClass("dragover");
+});
+dropZone.on("dragleave drop", function (e) {
+e.preventDefault();
+e.stopPropagation();
+dropZone.removeClass("dragover");
+});
+dropZone.on("drop", function (e) {
+e.preventDefault();
+e.stopPropagation();
+dropZone.removeClass("dragover");
+var files = e.originalEvent.dataTransfer.files;
+showStatus("");
+filesSelected(files);
+});
+var CHUNK_PARALLELISM = 3;
+var CHUNK_RETRIES = 3;
+function errorMessage(xhr, error) {
+try {
+const body = JSON.parse(xhr.responseText);
+return body.error || body.message || error || "Upload failed";
+} catch (e) {
+return error || "Upload failed";
+}
+}
+function postJson(handler, payload) {
+return new Promise((resolve, reject) => {
+$.ajax({
+type: "POST",
+url: runtime.handlerUrl(element, handler),
+contentType: "application/json; charset=utf-8",
+data: JSON.stringify(payload),
+success: resolve,
+error: (xhr, _status, error) => {
+const exc = new Error(errorMessage(xhr, error));
+exc.status = xhr.status;
+reject(exc);
+},
+});
+});
+}
+function sessionKey(file) {
+return ["uploadfile", runtime.handlerUrl(element, "upload_init"), file.name, file.size, file.lastModified].join(":");
+}
+function rememberSession(file, uploadId) {
+try {
+window.localStorage.setItem(sessionKey(file), uploadId);
+} catch (e) {
+}
+}
+function previousSession(file) {
+try {
+return window.localStorage.getItem(sessionKey(file));
+} catch (e) {
+return null;
+}
+}
+function forgetSession(file) {
+try {
+window.localStorage.removeItem(sessionKey(file));
+} catch (e) {
+}
+}
+function delay(ms) {
+return new Promise((resolve) => setTimeout(resolve, ms));
+}
+function sendChunk(uploadId, file, offset, length) {
+return new Promise((resolve, reject) => {
+$.ajax({
+url: runtime.handlerUrl(element, "upload_chunk", uploadId + "/" + offset),
+method: "POST",
+data: file.slice(offset, offset + length),
+processData: false,
+contentType: "application/octet-stream",
+success: resolve,
+error: (xhr, _status, error) => {
+const exc = new Error(errorMessage(xhr, error));
+exc.status = xhr.status;
+reject(exc);
+},
+});
+});
+}
+async function sendChunkWithRetry(uploadId, file, offset, length) {
+for (let attempt = 0; ; attempt++) {
+try {
+return await sendChunk(uploadId, file, offset, length);
+} catch (error) {
+if (attempt >= CHUNK_RETRIES || (error.status >= 400 && error.status < 500)) {
+throw error;
+}
+await delay(1000 * Math.pow(2, attempt));
+}
+}
+}
+async function uploadFileInChunks(file, progress) {
+const session = await postJson("upload_init", {
+filename: file.name,
+file_size: file.size,
+file_type: file.type,
+upload_id: previousSession(file),
+});
+rememberSession(file, session.upload_id);
+const received = new Set(session.received.map(([offset, length]) => offset + ":" + length));
+const pending = [];
+for (let offset = 0; offset < file.size; offset += session.chunk_size) {
+const length = Math.min(session.chunk_size, file.size - offset);
+if (received.has(offset + ":" + length)) {
+progress(length);
+} else {
+pending.push([offset, length]);
+}
+}
+async function worker() {
+while (pending.length) {
+const [offset, length] = pending.shift();
+await sendChunkWithRetry(session.upload_id, file, offset, length);
+progress(length);
+}
+}
+const workers = [];
+for (let i = 0; i < Math.min(CHUNK_PARALLELISM, pending.length); i++) {
+workers.push(worker());
+}
+await Promise.all(workers);
+return session.upload_id;
+}
+function putToStorage(target, file) {
+let data = file;
+if (target.fields) {
+data = new FormData();
+Object.entries(target.fields).forEach(([name, value]) => data.append(name, value));
+data.append("file", file);
+}
+return new Promise((resolve, reject) => {
+$.ajax({
+url: target.url,
+method: target.method,
+headers: target.headers,
+data,
+processData: false,
+contentType: false,
+success: resolve,
+error: (xhr, _status, error) => reject(new Error(errorMessage(xhr, error))),
+});
+});
+}
+async function uploadFileDirect(file, progress) {
+const target = await postJson("presign_upload", {
+filename: file.name,
+file_size: file.size,
+file_type: file.type,
+});
+await putToStorage(target, file);
+progress(file.size);
+return target.upload_token;
+}
+async function uploadFiles() {
+try {
+showStatus("Uploading...");
+const files = Array.from(selectedFiles);
+const total = files.reduce((sum, file) => sum + file.size, 0);
+let sent = 0;
+const progress = (length) => {
+sent += length;
+if (total > 0) {
+showStatus(`Uploading... ${Math.floor((100 * sent) / total)}%`);
+}
+};
+let response;
+if (directUpload) {
+const uploadTokens = [];
+for (const file of files) {
+uploadTokens.push(await uploadFileDirect(file, progress));
+}
+response = await postJson("confirm_upload", { upload_tokens: uploadTokens });
+} else {
+const uploadIds = [];
+for (const file of files) {
+uploadIds.push(await uploadFileInChunks(file, progress));
+}
+response = await postJson("upload_finalize", { upload_ids: uploadIds });
+files.forEach(forgetSession);
+}
+selectedFiles = null;
+showContent(response, "Uploaded successfully!");
+} catch (error) {
+console.log('exception', error);
+refresh(`Upload failed: ${error.message}`);
+}
+}
+uploadBtn.click(function () {
+if (!selectedFiles || selectedFiles.length === 0) {
+showStatus("Please select or drop a file.");
+return;
+}
+uploadFiles();
+});
+function beforeUnload(event) {
+if (selectedFiles) {
+event.preventDefault();
+event.returnValue = "";
+}
+}
+window.addEventListener("beforeunload", beforeUnload);
+}
@@ -0,0 +1,234 @@
+"""
+Reclamation of stored files that are no longer referenced.
+
+When a learner replaces their submission, the superseded files are
+recorded in a pending-deletion journal: one small JSON object per file under
+`xblock_uploadfile/.pending-deletion/`, named so that a listing is ordered
+by the time it was queued. `sweep` deletes journaled files in rate-limited
+batches once they are older than a grace period, so downloads that are
+still in flight can finish. Content-addressed blobs are only deleted when
+no reference to them is left. Swept entries are taken off the learner's
+storage usage (see uploadfile.usage). Sweeping also deletes the parts of
+chunked uploads that have not been written to for UPLOAD_SESSION_TTL, as a
+learner who abandons an upload may never start another one.
+
+`reconcile` finds files that leaked before the journal existed (or from
+uploads that were never confirmed) by comparing a storage listing with the
+paths referenced from learner state, and journals them.
+"""
+import json
+import logging
+import posixpath
+import time
+import uuid
+
+from django.core.files.base import ContentFile
+
+from . import blobs, chunks, usage
+from .processing import VARIANTS, split_variant, variant_path
+
+log = logging.getLogger(__name__)
+
+ROOT = "xblock_uploadfile"
+JOURNAL_ROOT = f"{ROOT}/.pending-deletion"
+# storage prefixes that are managed elsewhere and never reconciled
+INTERNAL_DIRS = frozenset([".pending-deletion", ".parts", "refs"])
+
+
+def journal_deletion(storage, file_info, user_id=None, usage_id=None, course_id=None):
+    """Records a superseded file (or a released blob) for deletion."""
+    queued_at = time.time()
+    entry = {
+        "file_path": file_info["file_path"],
+        "sha256": file_info.get("sha256"),
+        "size": file_info.get("size"),
+        "user_id": None if user_id is None else str(user_id),
+        "usage_id": None if usage_id is None else str(usage_id),
+        "course_id": None if course_id is None else str(course_id),
+        "queued_at": queued_at,
+    }
+    name = f"{JOURNAL_ROOT}/{int(queued_at):012d}-{uuid.uuid4().hex}.json"
+    storage.save(name, ContentFile(json.dumps(entry).encode("utf8")))
+
+
+def _queued_at(name):
+    try:
+        return int(name.split("-", 1)[0])
+    except ValueError:
+        return 0
+
+
+def pending_deletions(storage):
+    """Returns the journal entry names, oldest first."""
+    try:
+        (_dirs, files) = storage.listdir(JOURNAL_ROOT)
+    except (FileNotFoundError, NotADirectoryError):
+        return []
+    return sorted(files)
+
+
+def _reclaim(storage, entry, dry_run):
+    """
+    Deletes the file of one journal entry and its variants. Returns True if
+    the file was deleted.
+    """
+    file_path = entry["file_path"]
+    if entry.get("sha256") and blobs.ref_count(storage, entry["sha256"]):
+        # the blob is still used by other submissions
+        return False
+    if split_variant(file_path)[1] is None:
+        for variant in VARIANTS:
+            path = variant_path(file_path, variant)
+            if not dry_run and storage.exists(path):
+                storage.delete(path)
+    if not storage.exists(file_path):
+        return False
+    if not dry_run:
+        storage.delete(file_path)
+    return True
+
+
+def _listdir(storage, path):
+    try:
+        return storage.listdir(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return ([], [])
+
+
+def abandoned_uploads(storage, max_age=chunks.UPLOAD_SESSION_TTL):
+    """
+    Yields (user_id, upload_id) for each chunked upload that has parts, none of
+    them written in the last `max_age` seconds.
+    """
+    cutoff = time.time() - max_age
+    for user_id in _listdir(storage, ROOT)[0]:
+        if user_id in INTERNAL_DIRS:
+            continue
+        for upload_id in _listdir(storage, posixpath.join(ROOT, user_id, ".parts"))[0]:
+            parts_dir = chunks.parts_dir(user_id, upload_id)
+            names = _listdir(storage, parts_dir)[1]
+            # parts of unknown age may belong to an upload in progress
+            if names and all(_modified_before(storage, posixpath.join(parts_dir, name), cutoff, unknown=False)
+                             for name in names):
+                yield (user_id, upload_id)
+
+
+def sweep(storage, grace_period=24 * 60 * 60, batch_size=100, rate=None, max_entries=None, dry_run=False):
+    """
+    Processes the pending-deletion journal, oldest entries first, deleting the
+    files of entries queued more than `grace_period` seconds ago. Work is done
+    in batches of `batch_size`; with `rate`, at most that many entries are
+    processed per second. Then deletes the parts of abandoned chunked uploads.
+    Returns a dict of counts.
+    """
+    stats = {"processed": 0, "deleted": 0, "kept": 0, "failed": 0, "abandoned_uploads": 0}
+    cutoff = time.time() - grace_period
+    batch_started = time.monotonic()
+    for name in pending_deletions(storage):
+        if _queued_at(name) > cutoff or (max_entries is not None and stats["processed"] >= max_entries):
+            break
+        journal_path = f"{JOURNAL_ROOT}/{name}"
+        try:
+            with storage.open(journal_path, "rb") as journal_file:
+                entry = json.loads(journal_file.read().decode("utf8"))
+            if _reclaim(storage, entry, dry_run):
+                stats["deleted"] += 1
+            else:
+                stats["kept"] += 1
+            if not dry_run:
+                storage.delete(journal_path)
+                if entry.get("size") is not None and entry.get("usage_id"):
+                    usage.record(
+                        entry.get("course_id") or "", entry["usage_id"], entry["user_id"],
+                        -entry["size"], -1, pending_bytes=-entry["size"])
+        except Exception as e:  # pylint: disable=broad-except
+            log.warning("sweep: failed to process %s: %s", journal_path, e)
+            stats["failed"] += 1
+        stats["processed"] += 1
+
+        if stats["processed"] % batch_size == 0:
+            if rate:
+                # hold the average to `rate` entries per second
+                pause = batch_size / rate - (time.monotonic() - batch_started)
+                if pause > 0:
+                    time.sleep(pause)
+            batch_started = time.monotonic()
+
+    for (user_id, upload_id) in abandoned_uploads(storage):
+        if not dry_run:
+            chunks.delete_parts(storage, user_id, upload_id)
+        stats["abandoned_uploads"] += 1
+    log.info("sweep: %s", stats)
+    return stats
+
+
+def walk(storage, root=ROOT):
+    """Yields the paths of all stored files under `root`, except internal ones."""
+    (dirs, files) = _listdir(storage, root)
+    for name in files:
+        yield posixpath.join(root, name)
+    for name in dirs:
+        if name not in INTERNAL_DIRS:
+            yield from walk(storage, posixpath.join(root, name))
+
+
+def _modified_before(storage, path, cutoff, unknown=True):
+    try:
+        return storage.get_modified_time(path).timestamp() < cutoff
+    except (NotImplementedError, AttributeError, OSError):
+        return unknown
+
+
+def reconcile(storage, referenced_paths, min_age=24 * 60 * 60, dry_run=False):
+    """
+    Compares the files in storage with `referenced_paths`, an iterable of the
+    `file_path` of every file in learner state, and journals the stored files
+    that nothing references. Files modified in the last `min_age` seconds are
+    left alone, since they may belong to an upload in progress. Files in
+    learner directories are left alone for at least UPLOAD_SESSION_TTL, as a
+    direct upload can be confirmed until then. Blobs are
+    orphaned when no reference marker is left, and variants when their
+    original is orphaned. Returns the orphaned paths.
+    """
+    referenced = set(referenced_paths)
+    now = time.time()
+    cutoff = now - min_age
+    learner_cutoff = now - max(min_age, chunks.UPLOAD_SESSION_TTL)
+    orphans = []
+    for path in walk(storage):
+        (original_path, _variant) = split_variant(path)
+        if original_path in referenced:
+            continue
+        if original_path.startswith(f"{blobs.BLOB_ROOT}/"):
+            digest = posixpath.basename(original_path)
+            if blobs.ref_count(storage, digest):
+                continue
+            file_info = {"file_path": path, "sha256": digest}
+            path_cutoff = cutoff
+        else:
+            file_info = {"file_path": path}
+            path_cutoff = learner_cutoff
+        if not _modified_before(storage, path, path_cutoff):
+            continue
+        orphans.append(path)
+        if not dry_run:
+            journal_deletion(storage, file_info)
+    log.info("reconcile: %d orphaned files%s", len(orphans), " (dry run)" if dry_run else "")
+    return orphans
+
+
+def referenced_paths_from_lms():
+    """
+    Yields the `file_path` of every file in the state of every UploadFile block,
+    read from the LMS courseware student modules. Raises ImportError outside of
+    the LMS.
+    """
+    # pylint: disable=import-error,import-outside-toplevel
+    from lms.djangoapps.courseware.models import StudentModule
+    from .state import learner_files
+
+    states = StudentModule.objects.filter(module_type="uploadfile").values_list("state", flat=True)
+    for state in states.iterator():
+        for file_info in learner_files(json.loads(state or "{}")):
+            if file_info.get("file_path"):
+                yield file_info["file_path"]
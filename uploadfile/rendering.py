@@ -0,0 +1,179 @@
+"""
+Template rendering for the UploadFile XBlock.
+
+Templates are read from the package and compiled once per process. The
+settings-scoped part of the student view (prompt, accepted file types, ...)
+is filled in once per block and settings combination and memoized, so a
+render only has to fill in the per-learner state.
+
+The CSS and JS are served by URL from the minified, content-hashed copies in
+`public/` that bin/build_assets.py lists in `public/manifest.json`.
+"""
+import hashlib
+import html
+import json
+import logging
+import string
+import threading
+from collections import OrderedDict
+
+import pkg_resources
+
+STUDENT_TEMPLATE = "static/html/uploadfile.html"
+FILE_TEMPLATE = "static/html/file.html"
+THUMBNAIL_FILE_TEMPLATE = "static/html/file_thumbnail.html"
+FILE_SEPARATOR = ",&#32;"
+ASSET_MANIFEST = "public/manifest.json"
+
+log = logging.getLogger(__name__)
+
+
+class CompiledTemplate:
+    """
+    A `str.format` style template that has been split into literal text and
+    field names, so rendering is a single join instead of a reparse.
+    """
+
+    def __init__(self, segments):
+        # list of (literal_text, field_name or None)
+        self.segments = segments
+
+    @classmethod
+    def compile(cls, source):
+        segments = []
+        for (literal, field_name, _spec, _conversion) in string.Formatter().parse(source):
+            segments.append((literal, field_name))
+        return cls(segments)
+
+    @property
+    def fields(self):
+        return {field for (_literal, field) in self.segments if field is not None}
+
+    def partial(self, **values):
+        """
+        Returns a new template with the given fields substituted and the
+        remaining fields left in place.
+        """
+        segments = []
+        pending = ""
+        for (literal, field) in self.segments:
+            pending += literal
+            if field is None:
+                continue
+            if field in values:
+                pending += str(values[field])
+            else:
+                segments.append((pending, field))
+                pending = ""
+        segments.append((pending, None))
+        return CompiledTemplate(segments)
+
+    def render(self, **values):
+        out = []
+        for (literal, field) in self.segments:
+            out.append(literal)
+            if field is not None:
+                out.append(str(values[field]))
+        return "".join(out)
+
+
+class RenderEngine:
+    """
+    Loads and compiles the block templates once and keeps a bounded LRU of
+    settings-scoped student view templates keyed by (usage_id, settings hash).
+    """
+
+    def __init__(self, package, cache_size=1024):
+        self.package = package
+        self.cache_size = cache_size
+        self._resources = {}
+        self._templates = {}
+        self._partials = OrderedDict()
+        self._assets = None
+        self._lock = threading.Lock()
+
+    def resource(self, path):
+        """Returns the decoded contents of a package resource, read once."""
+        data = self._resources.get(path)
+        if data is None:
+            data = pkg_resources.resource_string(self.package, path).decode("utf8")
+            self._resources[path] = data
+        return data
+
+    def _load_assets(self):
+        try:
+            manifest = json.loads(pkg_resources.resource_string(self.package, ASSET_MANIFEST))
+        except (OSError, ValueError) as e:
+            log.info("No built assets, they will be inlined: %s", e)
+            return {}
+        assets = {}
+        for (path, entry) in manifest.items():
+            source_sha256 = hashlib.sha256(self.resource(path).encode("utf8")).hexdigest()
+            if source_sha256 == entry["source_sha256"]:
+                assets[path] = entry["path"]
+            else:
+                log.warning("%s is out of date, run bin/build_assets.py; the source is inlined", entry["path"])
+        return assets
+
+    def asset(self, path):
+        """
+        Returns the path of the built copy of the static asset at `path`, or
+        None if there is no copy that was built from the current source.
+        """
+        if self._assets is None:
+            self._assets = self._load_assets()
+        return self._assets.get(path)
+
+    def template(self, path):
+        compiled = self._templates.get(path)
+        if compiled is None:
+            compiled = CompiledTemplate.compile(self.resource(path))
+            self._templates[path] = compiled
+        return compiled
+
+    @staticmethod
+    def settings_hash(settings):
+        encoded = json.dumps(settings, sort_keys=True, default=str)
+        return hashlib.sha1(encoded.encode("utf8")).hexdigest()
+
+    def settings_template(self, usage_id, settings):
+        """
+        Returns the student template with the settings-scoped fields filled in.
+        """
+        key = (str(usage_id), self.settings_hash(settings))
+        with self._lock:
+            partial = self._partials.get(key)
+            if partial is not None:
+                self._partials.move_to_end(key)
+                return partial
+        partial = self.template(STUDENT_TEMPLATE).partial(**settings)
+        with self._lock:
+            self._partials[key] = partial
+            while len(self._partials) > self.cache_size:
+                self._partials.popitem(last=False)
+        return partial
+
+    def render_student_view(self, usage_id, settings, learner):
+        return self.settings_template(usage_id, settings).render(**learner)
+
+    def render_file_list(self, files):
+        """
+        Renders the list of uploaded files. `files` is a list of
+        (download_url, user_filename, thumbnail_url or None) tuples.
+        """
+        file_template = self.template(FILE_TEMPLATE)
+        thumbnail_template = self.template(THUMBNAIL_FILE_TEMPLATE)
+        return FILE_SEPARATOR.join(
+            thumbnail_template.render(
+                file_url=html.escape(url), filename=html.escape(filename or ""),
+                thumbnail_url=html.escape(thumbnail_url))
+            if thumbnail_url else
+            file_template.render(file_url=html.escape(url), filename=html.escape(filename or ""))
+            for (url, filename, thumbnail_url) in files)
+
+    def clear(self):
+        with self._lock:
+            self._partials.clear()
+
+
+ENGINE = RenderEngine(__name__)
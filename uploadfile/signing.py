@@ -0,0 +1,122 @@
+"""
+Signed URLs for direct-to-storage uploads and downloads.
+
+In DIRECT_STORAGE mode the block hands out short-lived signed URLs so that
+file bytes travel between the browser and the storage backend without
+passing through the LMS workers. The signer is pluggable through the
+SIGNER setting:
+
+* `uploadfile.signing.S3Signer` presigns URLs with the boto3 client of a
+  django-storages S3 backend.
+* `uploadfile.signing.LocalSigner` is a stand-in for backends that cannot
+  sign URLs, such as the local filesystem. Its URLs point at the block's
+  `local_storage` handler and carry a Django signed token, so the direct
+  storage path can be exercised offline.
+"""
+import urllib
+
+from django.core import signing
+from django.core.files.storage import default_storage
+from django.utils.module_loading import import_string
+
+from .config import get_setting
+from .download import content_disposition
+
+LOCAL_SALT = "uploadfile.signing.local"
+
+
+class Signer:
+    """
+    Creates signed URLs for storage objects. `upload_url` returns a dict with
+    the `url`, the HTTP `method` and any `headers` the browser must send, and
+    for a POST the form `fields` to send before the file. The upload must be
+    refused if it is larger than `max_size`. `download_url` returns a URL.
+    """
+
+    def upload_url(self, block, path, content_type, expires, max_size):
+        raise NotImplementedError
+
+    def download_url(self, block, path, user_filename, content_type, expires):
+        raise NotImplementedError
+
+
+class S3Signer(Signer):
+    """Presigned URLs from a django-storages S3 backend."""
+
+    def __init__(self, storage=None):
+        self.storage = storage or default_storage
+
+    def _key(self, path):
+        # the storage prefixes its configured location to object names
+        normalize = getattr(self.storage, "_normalize_name", None)
+        return normalize(path) if normalize else path
+
+    def upload_url(self, block, path, content_type, expires, max_size):
+        client = self.storage.bucket.meta.client
+        # a presigned PUT cannot limit the size of the object, a POST policy can
+        post = client.generate_presigned_post(
+            Bucket=self.storage.bucket_name,
+            Key=self._key(path),
+            Fields={"Content-Type": content_type},
+            Conditions=[{"Content-Type": content_type}, ["content-length-range", 0, max_size]],
+            ExpiresIn=expires,
+        )
+        return {"url": post["url"], "method": "POST", "headers": {}, "fields": post["fields"]}
+
+    def download_url(self, block, path, user_filename, content_type, expires):
+        return self.storage.url(path, parameters={
+            "ResponseContentDisposition": content_disposition(user_filename),
+            "ResponseContentType": content_type,
+        }, expire=expires)
+
+
+class LocalSigner(Signer):
+    """
+    Signs URLs to the block's own `local_storage` handler, which reads and
+    writes `default_storage` after checking the token.
+    """
+
+    def _url(self, block, method, path, content_type, expires, user_filename=None, max_size=None):
+        token = signing.dumps({
+            "method": method,
+            "path": path,
+            "content_type": content_type,
+            "user_filename": user_filename,
+            "max_size": max_size,
+            "expires": expires,
+        }, salt=LOCAL_SALT)
+        return block.runtime.handler_url(block, "local_storage", suffix=urllib.parse.quote(token))
+
+    def upload_url(self, block, path, content_type, expires, max_size):
+        url = self._url(block, "PUT", path, content_type, expires, max_size=max_size)
+        return {"url": url, "method": "PUT", "headers": {"Content-Type": content_type}}
+
+    def download_url(self, block, path, user_filename, content_type, expires):
+        return self._url(block, "GET", path, content_type, expires, user_filename)
+
+    @staticmethod
+    def verify(token, method):
+        """
+        Returns the claims of a `local_storage` token, or raises
+        django.core.signing.BadSignature if it is invalid, expired or was issued
+        for another method.
+        """
+        claims = signing.loads(token, salt=LOCAL_SALT)
+        # the expiry is part of the signed claims, so check the age against it
+        signing.loads(token, salt=LOCAL_SALT, max_age=claims["expires"])
+        if claims["method"] != method:
+            raise signing.BadSignature("Token was issued for another method")
+        return claims
+
+
+_SIGNERS = {}
+
+
+def get_signer():
+    """Returns the configured signer, instantiated once per process."""
+    name = get_setting("SIGNER")
+    signer = _SIGNERS.get(name)
+    if signer is None:
+        signer = import_string(name)()
+        _SIGNERS[name] = signer
+    return signer
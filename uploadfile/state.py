@@ -0,0 +1,62 @@
+"""
+Versioned schema of the learner state of an UploadFile block.
+
+Version 2 keeps one compact entry per file in `file_info_list`:
+
+* `user_filename`, the name the learner uploaded,
+* `file_path`, the name of the stored file,
+* `size` and `content_type`,
+* `sha256` and `blob_ref`, for content-addressed files only,
+* `variants`, the derived variants of the file that have been stored, and
+  `pending_variants` and `queued_at`, those still being processed (see
+  uploadfile.processing),
+* `codec`, for files that are compressed at rest (see uploadfile.compression).
+
+Download URLs are derived from the index of the entry when a page is
+rendered, so they are not stored.
+
+Version 1 (state without `state_version`) kept a redundant `filename` and an
+absolute `file_url` in every entry, and older learners may still have a single
+file in the legacy `file_info` dict. Such state is upgraded in memory when it
+is read and written back in version 2 the next time the learner's files
+change, so no bulk migration is needed.
+"""
+
+STATE_VERSION = 2
+
+FILE_FIELDS = (
+    "user_filename",
+    "file_path",
+    "size",
+    "content_type",
+    "sha256",
+    "blob_ref",
+    "variants",
+    "pending_variants",
+    "queued_at",
+    "codec",
+)
+
+
+def compact_file_info(file_info):
+    """Returns the version 2 entry of a file entry of any version."""
+    entry = {key: file_info[key] for key in FILE_FIELDS if file_info.get(key) is not None}
+    if "file_path" not in entry and file_info.get("filename"):
+        entry["file_path"] = file_info["filename"]
+    return entry
+
+
+def upgrade_files(file_info_list, file_info):
+    """The version 2 entries of version 1 state."""
+    if file_info_list:
+        return [compact_file_info(entry) for entry in file_info_list]
+    if file_info:
+        return [compact_file_info(file_info)]
+    return []
+
+
+def learner_files(state):
+    """The file entries of a learner state, as stored in the courseware student module."""
+    if state.get("state_version", 1) >= STATE_VERSION:
+        return state.get("file_info_list") or []
+    return upgrade_files(state.get("file_info_list"), state.get("file_info"))
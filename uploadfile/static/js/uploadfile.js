@@ -5,6 +5,14 @@ function UploadFileXBlock(runtime, element) {
   var statusDiv = $("#uploadfile-status", element);
   var selectedFiles = null;
   var maxSizeMb = parseInt($(".uploadfile-xblock", element).data('max-size-mb'));
+  var directUpload = $(".uploadfile-xblock", element).data('direct-upload') === true;
+  // the rendered state, so a refresh can be skipped when nothing has changed
+  var content = {
+    file_html: dropZone.find("#drop-zone-text").html(),
+    file_subtext: dropZone.find("#drop-zone-subtext").text(),
+    instructions: dropZone.find("#instructions").text(),
+    state_etag: $(".uploadfile-xblock", element).attr('data-state-etag'),
+  };
   uploadBtn.hide();
   // Allow clicking the drop zone to trigger file input
   dropZone.on("click", function (e) {
@@ -16,19 +24,27 @@ function UploadFileXBlock(runtime, element) {
     statusDiv.text(status);
   }
 
+  function showContent(response, status) {
+    if (!response.not_modified) {
+      const { file_html, file_subtext, instructions, state_etag } = response;
+      content = { file_html, file_subtext, instructions, state_etag };
+    }
+    // the selected files may have replaced the file list
+    dropZone.find("#drop-zone-text").html(content.file_html);
+    dropZone.find("#drop-zone-subtext").text(content.file_subtext);
+    dropZone.find("#instructions").text(content.instructions);
+    uploadBtn.hide();
+    showStatus(status);
+  }
+
   function refresh(status) {
     $.ajax({
       type: "POST",
       url: runtime.handlerUrl(element, "refresh_content"),
       contentType: "application/json; charset=utf-8",
-      data: JSON.stringify({}),
+      data: JSON.stringify({ state_etag: content.state_etag }),
       success: function (response) {
-        const { file_html, file_subtext, instructions } = response;
-        dropZone.find("#drop-zone-text").html(file_html);
-        dropZone.find("#drop-zone-subtext").text(file_subtext);
-        dropZone.find("#instructions").text(instructions);
-        uploadBtn.hide();
-        showStatus(status);
+        showContent(response, status);
       },
     });
   }
@@ -90,54 +106,207 @@ function UploadFileXBlock(runtime, element) {
     filesSelected(files);
   });
 
-  async function uploadFiles() {
+  // Chunked, resumable upload: each file is sent in bounded chunks, a few
+  // in parallel, and an interrupted upload picks up where it left off.
+  var CHUNK_PARALLELISM = 3;
+  var CHUNK_RETRIES = 3;
+
+  function errorMessage(xhr, error) {
     try {
-      showStatus("Uploading...");
-      // Upload files using Streams API
-      // const results = await Promise.all(
-      //   Array.from(selectedFiles).map((file) => uploadFileAsStream(file)),
-      // );
-      await uploadFilesAsStream(selectedFiles)
-      refresh();
-      selectedFiles = null;
-      showStatus("Uploaded successfully!");
-      // this.displayResults(results);
-    } catch (error) {
-      console.log('exception', error);
-      refresh();
-      showStatus(`Upload failed: ${error.message}`);
+      const body = JSON.parse(xhr.responseText);
+      return body.error || body.message || error || "Upload failed";
+    } catch (e) {
+      return error || "Upload failed";
     }
   }
 
-  async function uploadFilesAsStream(files) {
-    const uploadUrl = runtime.handlerUrl(element, "stream_upload");
+  function postJson(handler, payload) {
+    return new Promise((resolve, reject) => {
+      $.ajax({
+        type: "POST",
+        url: runtime.handlerUrl(element, handler),
+        contentType: "application/json; charset=utf-8",
+        data: JSON.stringify(payload),
+        success: resolve,
+        error: (xhr, _status, error) => {
+          const exc = new Error(errorMessage(xhr, error));
+          exc.status = xhr.status;
+          reject(exc);
+        },
+      });
+    });
+  }
+
+  function sessionKey(file) {
+    return ["uploadfile", runtime.handlerUrl(element, "upload_init"), file.name, file.size, file.lastModified].join(":");
+  }
 
-    const formData = new FormData();
-    for (const file of files) {
-      formData.append("files[]", file);
+  function rememberSession(file, uploadId) {
+    try {
+      window.localStorage.setItem(sessionKey(file), uploadId);
+    } catch (e) {
+      // storage not available, uploads just won't resume across page loads
+    }
+  }
+
+  function previousSession(file) {
+    try {
+      return window.localStorage.getItem(sessionKey(file));
+    } catch (e) {
+      return null;
+    }
+  }
+
+  function forgetSession(file) {
+    try {
+      window.localStorage.removeItem(sessionKey(file));
+    } catch (e) {
+      // ignore
     }
-    // formData.append("filename", file.name);
-    // formData.append("file_size", file.size);
-    // formData.append("file_type", file.type);
+  }
+
+  function delay(ms) {
+    return new Promise((resolve) => setTimeout(resolve, ms));
+  }
 
+  function sendChunk(uploadId, file, offset, length) {
     return new Promise((resolve, reject) => {
       $.ajax({
-        url: uploadUrl,
+        url: runtime.handlerUrl(element, "upload_chunk", uploadId + "/" + offset),
         method: "POST",
-        data: formData,
-        processData: false,  // Don't process FormData
-        contentType: false,  // Let browser set content-type
-        success: (response) => {
-          resolve(response);
+        data: file.slice(offset, offset + length),
+        processData: false,
+        contentType: "application/octet-stream",
+        success: resolve,
+        error: (xhr, _status, error) => {
+          const exc = new Error(errorMessage(xhr, error));
+          exc.status = xhr.status;
+          reject(exc);
         },
-        error: (_xhr, _status, error) => {
-          console.log('uploadFileAsStream error', error, _status);
-          reject(new Error(error || 'Upload failed'));
+      });
+    });
+  }
+
+  async function sendChunkWithRetry(uploadId, file, offset, length) {
+    for (let attempt = 0; ; attempt++) {
+      try {
+        return await sendChunk(uploadId, file, offset, length);
+      } catch (error) {
+        // client errors will not go away by retrying
+        if (attempt >= CHUNK_RETRIES || (error.status >= 400 && error.status < 500)) {
+          throw error;
         }
+        await delay(1000 * Math.pow(2, attempt));
+      }
+    }
+  }
+
+  async function uploadFileInChunks(file, progress) {
+    const session = await postJson("upload_init", {
+      filename: file.name,
+      file_size: file.size,
+      file_type: file.type,
+      upload_id: previousSession(file),
+    });
+    rememberSession(file, session.upload_id);
+
+    const received = new Set(session.received.map(([offset, length]) => offset + ":" + length));
+    const pending = [];
+    for (let offset = 0; offset < file.size; offset += session.chunk_size) {
+      const length = Math.min(session.chunk_size, file.size - offset);
+      if (received.has(offset + ":" + length)) {
+        progress(length);
+      } else {
+        pending.push([offset, length]);
+      }
+    }
+
+    async function worker() {
+      while (pending.length) {
+        const [offset, length] = pending.shift();
+        await sendChunkWithRetry(session.upload_id, file, offset, length);
+        progress(length);
+      }
+    }
+    const workers = [];
+    for (let i = 0; i < Math.min(CHUNK_PARALLELISM, pending.length); i++) {
+      workers.push(worker());
+    }
+    await Promise.all(workers);
+    return session.upload_id;
+  }
+
+  // Direct upload: each file is sent straight to storage with a signed URL
+  // and the uploads are then confirmed with the block.
+  function putToStorage(target, file) {
+    let data = file;
+    if (target.fields) {
+      // a POST policy upload: the signed fields come first, then the file
+      data = new FormData();
+      Object.entries(target.fields).forEach(([name, value]) => data.append(name, value));
+      data.append("file", file);
+    }
+    return new Promise((resolve, reject) => {
+      $.ajax({
+        url: target.url,
+        method: target.method,
+        headers: target.headers,
+        data,
+        processData: false,
+        contentType: false,
+        success: resolve,
+        error: (xhr, _status, error) => reject(new Error(errorMessage(xhr, error))),
       });
     });
   }
 
+  async function uploadFileDirect(file, progress) {
+    const target = await postJson("presign_upload", {
+      filename: file.name,
+      file_size: file.size,
+      file_type: file.type,
+    });
+    await putToStorage(target, file);
+    progress(file.size);
+    return target.upload_token;
+  }
+
+  async function uploadFiles() {
+    try {
+      showStatus("Uploading...");
+      const files = Array.from(selectedFiles);
+      const total = files.reduce((sum, file) => sum + file.size, 0);
+      let sent = 0;
+      const progress = (length) => {
+        sent += length;
+        if (total > 0) {
+          showStatus(`Uploading... ${Math.floor((100 * sent) / total)}%`);
+        }
+      };
+      let response;
+      if (directUpload) {
+        const uploadTokens = [];
+        for (const file of files) {
+          uploadTokens.push(await uploadFileDirect(file, progress));
+        }
+        response = await postJson("confirm_upload", { upload_tokens: uploadTokens });
+      } else {
+        const uploadIds = [];
+        for (const file of files) {
+          uploadIds.push(await uploadFileInChunks(file, progress));
+        }
+        response = await postJson("upload_finalize", { upload_ids: uploadIds });
+        files.forEach(forgetSession);
+      }
+      selectedFiles = null;
+      // the response carries the re-rendered file list
+      showContent(response, "Uploaded successfully!");
+    } catch (error) {
+      console.log('exception', error);
+      refresh(`Upload failed: ${error.message}`);
+    }
+  }
+
   uploadBtn.click(function () {
     if (!selectedFiles || selectedFiles.length === 0) {
       showStatus("Please select or drop a file.");
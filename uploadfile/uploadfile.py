@@ -1,23 +1,57 @@
 """A file upload response for OpenEdx courses."""
 import base64
+import hashlib
 from webob import Response
+import html as html_lib
 import json
-import uuid
+import time
 import urllib
-from lxml import html as lxml_html
+import uuid
 
 import logging
-import pkg_resources
 from web_fragments.fragment import Fragment
 from xblock.core import XBlock
+from xblock.exceptions import JsonHandlerError
 from xblock.fields import Scope, String, Boolean, List, Dict, Integer
 from xblock.utils.studio_editable import StudioEditableXBlockMixin
+from django.core import signing
 from django.core.files.storage import default_storage
-from django.core.files.base import ContentFile
+from django.core.files.base import ContentFile, File
+
+from . import blobs, chunks, compression, processing, usage
+from .batch import UploadBatchError, run_batch
+from .chunks import UPLOAD_SESSION_TTL
+from .config import get_setting
+from .download import content_disposition, encoded_response, storage_metadata, make_etag, streaming_response
+from .export import iter_learner_states, iter_zip, safe_name
+from .metrics import InstrumentedStorage, get_metrics, instrumented
+from .reclaim import journal_deletion
+from .multipart import MultipartError, MultipartReader, UploadRejected, parse_boundary, spool_part
+from .rendering import ENGINE
+from .signing import LocalSigner, get_signer
+from .state import STATE_VERSION, compact_file_info, learner_files, upgrade_files
 
 log = logging.getLogger(__name__)
 
+MB = 1024 * 1024
+
+# all storage calls are timed through the configured metrics sink
+storage = InstrumentedStorage(default_storage)
+
+# user service attribute set by the LMS for course staff
+ATTR_KEY_USER_IS_STAFF = 'edx-platform.user_is_staff'
+# salt of the tokens that presign_upload hands out for confirm_upload
+CONFIRM_SALT = "uploadfile.confirm_upload"
+CSS_PATH = "static/css/uploadfile.css"
+JS_PATH = "static/js/uploadfile.js"
+
 
+def json_response(payload, status=200):
+    """A WebOb JSON response, for handlers that cannot use json_handler."""
+    return Response(json.dumps(payload), content_type='application/json; charset=utf-8', status=status)
+
+
+@XBlock.wants('user')
 class UploadFileBlock(StudioEditableXBlockMixin, XBlock):
     """
     Prompts the user to upload a file. Allows for download and reupload.
@@ -27,6 +61,8 @@ class UploadFileBlock(StudioEditableXBlockMixin, XBlock):
         "display_name",
         "file_types",
         "prompt",
+        "learner_quota_mb",
+        "block_quota_mb",
     ]
 
     display_name = String(
@@ -59,7 +95,13 @@ class UploadFileBlock(StudioEditableXBlockMixin, XBlock):
     file_info = Dict(
         default={},
         scope=Scope.user_state,
-        help="A map of the user responses on the worksheet",
+        help="Legacy single file, moved to file_info_list when the files next change",
+    )
+
+    state_version = Integer(
+        default=1,
+        scope=Scope.user_state,
+        help="Version of the schema of file_info_list, see uploadfile.state",
     )
 
     submitted = Boolean(
@@ -68,6 +110,18 @@ class UploadFileBlock(StudioEditableXBlockMixin, XBlock):
         help="A map of the user responses on the worksheet",
     )
 
+    upload_sessions = Dict(
+        default={},
+        scope=Scope.user_state,
+        help="Chunked uploads in progress, keyed by upload id",
+    )
+
+    direct_uploads = Dict(
+        default={},
+        scope=Scope.user_state,
+        help="Direct uploads that were presigned but not confirmed, keyed by file path",
+    )
+
     allow_multiple = Boolean(
         display_name="Allow multiple files",
         help="Alow the student to submit multiple files",
@@ -82,10 +136,30 @@ class UploadFileBlock(StudioEditableXBlockMixin, XBlock):
         scope=Scope.settings,
     )
 
+    max_total_size_mb = Integer(
+        display_name="Maximum upload size (MB)",
+        help="Restrict the total size of the files uploaded at once (0 for no limit)",
+        default=200,
+        scope=Scope.settings,
+    )
+
+    learner_quota_mb = Integer(
+        display_name="Storage quota per learner (MB)",
+        help="Restrict the storage used by each learner, including replaced files not yet deleted (0 for no limit)",
+        default=0,
+        scope=Scope.settings,
+    )
+
+    block_quota_mb = Integer(
+        display_name="Storage quota for all learners (MB)",
+        help="Restrict the storage used by all learners together (0 for no limit)",
+        default=0,
+        scope=Scope.settings,
+    )
+
     def resource_string(self, path):
         """Handy helper for getting resources from our kit."""
-        data = pkg_resources.resource_string(__name__, path)
-        return data.decode("utf8")
+        return ENGINE.resource(path)
 
     def state_class(self):
         if self.submitted:
@@ -93,8 +167,88 @@ class UploadFileBlock(StudioEditableXBlockMixin, XBlock):
         return "state-empty"
     # Displays the upload prompt
 
-    def download_url(self, index):
-        return self.runtime.handler_url(self, 'download_file', suffix=str(index))
+    def accepted_file_types(self):
+        return [file_type.strip().lower() for file_type in self.file_types.split(",") if file_type.strip()]
+
+    def is_file_type_allowed(self, filename, content_type):
+        """
+        Checks a file against `file_types`, which is interpreted like the
+        accept attribute of the file input: extensions and (wildcard) MIME types.
+        """
+        accepted = self.accepted_file_types()
+        if not accepted:
+            return True
+        filename = (filename or "").lower()
+        content_type = (content_type or "").lower()
+        for accepted_type in accepted:
+            if accepted_type.startswith("."):
+                if filename.endswith(accepted_type):
+                    return True
+            elif accepted_type.endswith("/*"):
+                if content_type.startswith(accepted_type[:-1]):
+                    return True
+            elif accepted_type == content_type:
+                return True
+        return False
+
+    def check_upload(self, filename, size, content_type):
+        """Raises UploadRejected if the file may not be uploaded to this block."""
+        if not self.is_file_type_allowed(filename, content_type):
+            raise UploadRejected(
+                415, "file_type", f"{filename} is not an accepted file type ({self.file_types})", filename)
+        if size is not None and size > self.max_size_mb * MB:
+            raise UploadRejected(
+                413, "file_size", f"{filename} is larger than {self.max_size_mb}Mb", filename)
+
+    def check_json_upload(self, filename, size, content_type):
+        """check_upload for json handlers: rejections become JsonHandlerErrors."""
+        try:
+            self.check_upload(filename, size, content_type)
+        except UploadRejected as e:
+            get_metrics().incr("upload.rejected", reason=e.details["reason"])
+            raise JsonHandlerError(e.status, str(e)) from e
+
+    def course_id(self):
+        return str(getattr(self.scope_ids.usage_id, 'course_key', None) or '')
+
+    def check_quota(self, new_bytes):
+        """
+        Raises UploadRejected if replacing the learner's files with `new_bytes`
+        of new files would exceed the learner or block quota. Replaced files
+        count towards the block quota until the sweeper has reclaimed them, but
+        not towards the learner quota.
+        """
+        if not (self.learner_quota_mb or self.block_quota_mb):
+            return
+        usage_id = self.scope_ids.usage_id
+        replaced = sum(file_info.get('size') or 0 for file_info in self.stored_files())
+        if self.learner_quota_mb:
+            learner_usage = usage.usage(self.course_id(), usage_id, self.runtime.user_id)
+            used = replaced
+            if learner_usage is not None:
+                used = learner_usage["bytes"] - learner_usage["pending_bytes"]
+            if used - replaced + new_bytes > self.learner_quota_mb * MB:
+                raise UploadRejected(
+                    413, "learner_quota", f"The upload would exceed your storage quota of {self.learner_quota_mb}Mb")
+        if self.block_quota_mb:
+            block_usage = usage.usage(self.course_id(), usage_id)
+            if block_usage is None:
+                log.warning("block_quota_mb of %s needs the usage index and is not enforced", usage_id)
+            elif block_usage["bytes"] - replaced + new_bytes > self.block_quota_mb * MB:
+                raise UploadRejected(
+                    413, "block_quota", "There is no storage left for uploads to this question")
+
+    def check_json_quota(self, new_bytes):
+        """check_quota for json handlers: rejections become JsonHandlerErrors."""
+        try:
+            self.check_quota(new_bytes)
+        except UploadRejected as e:
+            get_metrics().incr("upload.rejected", reason=e.details["reason"])
+            raise JsonHandlerError(e.status, str(e)) from e
+
+    def download_url(self, index, variant=None):
+        query = urllib.parse.urlencode({'variant': variant}) if variant else ''
+        return self.runtime.handler_url(self, 'download_file', suffix=str(index), query=query)
 
     def generate_instructions(self):
         if not self.submitted:
@@ -108,68 +262,98 @@ class UploadFileBlock(StudioEditableXBlockMixin, XBlock):
         instructions = f"{instructions}. Max allowed file size is {self.max_size_mb}Mb"
         return instructions
 
+    def stored_files(self):
+        """The learner's uploaded files, upgrading state of an older version."""
+        if self.state_version >= STATE_VERSION:
+            return self.file_info_list
+        return upgrade_files(self.file_info_list, self.file_info)
+
     def render_file_html(self):
         # returns (html, subtext) where html is an html snippet for the list of files and the subtext
         # is the intro, e.g. "Files uploaded:"
-        file_info_list = self.file_info_list
-        # handle legacy single file
-        if not file_info_list:
-            if self.file_info:
-                file_info_list = [self.file_info]
-            else:
-                file_info_list = []
-        file_template = self.resource_string("static/html/file.html")
-        file_details = [file_template.format(
-            file_url=self.download_url(index), filename=file.get("user_filename"))
-            for (index, file) in enumerate(file_info_list)]
+        file_info_list = self.stored_files()
+        file_details = ENGINE.render_file_list([
+            (
+                self.download_url(index),
+                file.get("user_filename"),
+                self.download_url(index, processing.THUMBNAIL)
+                if processing.THUMBNAIL in file.get("variants", ()) else None,
+            )
+            for (index, file) in enumerate(file_info_list)])
         has_file = self.submitted and len(file_info_list) > 0
         subtext = "Files uploaded:" if has_file else ""
 
-        return (",&#32;".join(file_details), subtext)
+        return (file_details, subtext)
+
+    def state_etag(self):
+        """A validator of everything the rendered file list and instructions depend on."""
+        state = [self.stored_files(), self.submitted, self.allow_multiple, self.max_size_mb]
+        return hashlib.sha1(json.dumps(state, sort_keys=True).encode('utf8')).hexdigest()
+
+    def rendered_content(self, state_etag=None):
+        """The parts of the student view that change with uploads, as returned to the JS."""
+        (html, subtext) = self.render_file_html()
+        return {
+            "file_html": html,
+            "file_subtext": subtext,
+            "instructions": self.generate_instructions(),
+            "state_etag": state_etag or self.state_etag(),
+        }
+
+    def settings_context(self):
+        """The settings-scoped template values, shared by all learners."""
+        return {
+            "prompt": self.prompt,
+            "file_types": self.file_types,
+            "accept": html_lib.escape(self.file_types),
+            "multiple": "multiple" if self.allow_multiple else "",
+            "max_size_mb": self.max_size_mb,
+            "direct_upload": "true" if get_setting("DIRECT_STORAGE") else "false",
+        }
+
+    def asset_url(self, path):
+        """The URL of the built copy of a static asset, or None if it has to be inlined."""
+        public_path = ENGINE.asset(path)
+        if public_path is None:
+            return None
+        try:
+            return self.runtime.local_resource_url(self, public_path)
+        except NotImplementedError:
+            return None
 
     def student_view(self, context=None):
         """
         The primary view of the UploadFile, shown to students
         when viewing courses.
         """
-        (file_html, subtext) = self.render_file_html()
-        multiple = "multiple" if self.allow_multiple else ""
-        instructions = self.generate_instructions()
-        html = self.resource_string("static/html/uploadfile.html").format(
-            prompt=self.prompt,
-            subtext=subtext,
-            file_types=self.file_types,
-            filename=file_html,
-            submitted="true" if self.submitted else "false",
-            state_class=self.state_class(),
-            multiple=multiple,
-            instructions=instructions,
-            max_size_mb=self.max_size_mb
-        )
-
-        # Parse HTML and add accept attribute to file inputs
-        try:
-            # Parse the HTML
-            doc = lxml_html.fromstring(html)
-
-            # Find all input elements with type="file"
-            file_inputs = doc.xpath('//input[@type="file"]')
-
-            # Add accept attribute to each file input
-            for file_input in file_inputs:
-                file_input.set('accept', self.file_types)
-
-            # Convert back to string
-            html = lxml_html.tostring(doc, encoding='unicode')
-
-        except Exception as e:
-            # If parsing fails, log the error and use original HTML
-            log.warning(
-                "Failed to parse HTML for adding accept attribute %s", e)
+        with get_metrics().timer("student_view.render"):
+            if self.resolve_variants():
+                self.save()
+            (file_html, subtext) = self.render_file_html()
+            html = ENGINE.render_student_view(
+                self.scope_ids.usage_id,
+                self.settings_context(),
+                {
+                    "subtext": subtext,
+                    "filename": file_html,
+                    "submitted": "true" if self.submitted else "false",
+                    "state_class": self.state_class(),
+                    "instructions": self.generate_instructions(),
+                    "state_etag": self.state_etag(),
+                })
 
         frag = Fragment(html)
-        frag.add_css(self.resource_string("static/css/uploadfile.css"))
-        frag.add_javascript(self.resource_string("static/js/uploadfile.js"))
+        # content-hashed URLs, so a unit with many blocks loads the code once
+        css_url = self.asset_url(CSS_PATH)
+        if css_url:
+            frag.add_css_url(css_url)
+        else:
+            frag.add_css(self.resource_string(CSS_PATH))
+        js_url = self.asset_url(JS_PATH)
+        if js_url:
+            frag.add_javascript_url(js_url)
+        else:
+            frag.add_javascript(self.resource_string(JS_PATH))
         frag.initialize_js('UploadFileXBlock')
         return frag
 
@@ -177,55 +361,85 @@ class UploadFileBlock(StudioEditableXBlockMixin, XBlock):
         user_id = self.runtime.user_id
         return f"xblock_uploadfile/{user_id}/{uuid.uuid4()}"
 
+    def save_upload(self, file, filename, content_type):
+        """
+        Saves an uploaded file under a new name, compressing it when
+        COMPRESS_AT_REST is on. Returns (file_path, codec).
+        """
+        codec = None
+        if get_setting("COMPRESS_AT_REST"):
+            (file, codec) = compression.encode(file, content_type, get_setting("COMPRESSION_LEVEL"))
+        return (storage.save(self.full_filename(filename), file), codec)
+
     @XBlock.json_handler
+    @instrumented("refresh_content")
     def refresh_content(self, data, suffix=''):
+        """
+        Returns the rendered file list and instructions. If `state_etag` is
+        the validator of the current state, the client is up to date and only
+        `not_modified` is returned.
+        """
         # if we use context in the future, then we must pass it here
         log.debug(
             "refresh_content %s", data)
-        instructions = self.generate_instructions()
-        (html, subtext) = self.render_file_html()
-        return {'success': True, 'file_html': html, "file_subtext": subtext, "instructions": instructions}
+        self.resolve_variants()
+        state_etag = self.state_etag()
+        if data.get('state_etag') == state_etag:
+            return {'success': True, 'not_modified': True, 'state_etag': state_etag}
+        return dict(self.rendered_content(state_etag), success=True)
 
     @XBlock.json_handler
+    @instrumented("upload_file")
     def upload_file(self, data, suffix=''):
         """
         Receives file uploads from the JS frontend, stores the file, and records submission.
-        This is a non-streaming, non-chnunking version
+        This is a non-streaming, non-chnunking version, kept for older clients.
+        New clients use the chunked upload handlers (upload_init, upload_chunk,
+        upload_status and upload_finalize).
         """
         log.debug(
             "upload_file %s", data)
         file_data_base64 = data['file_data']
         filename = data['filename']
-        file_size = data['file_size']
         file_type = data['file_type']
 
         binary_data = base64.b64decode(file_data_base64)
+        # the limits apply to the data received, not to the declared size
+        file_size = len(binary_data)
+        if data.get('file_size') is not None and data['file_size'] != file_size:
+            get_metrics().incr("upload.rejected", reason="file_size")
+            raise JsonHandlerError(400, f"{filename} does not have the declared size")
+        self.check_json_upload(filename, file_size, file_type)
+        self.check_json_quota(file_size)
 
         # Create a ContentFile from the binary data
-        content_file = ContentFile(binary_data)
+        content_file = ContentFile(binary_data, name=filename)
         # Save the file with Django's storage system
-        full_filename = self.full_filename(filename)
-        file_path = default_storage.save(full_filename, content_file)
-        file_url = default_storage.url(file_path)
+        (file_path, codec) = self.save_upload(content_file, filename, file_type)
 
-        self.file_info = {
+        file_info = {
             'user_filename': filename,
-            'filename': full_filename,
             'file_path': file_path,
-            'file_url': file_url,
             'size': file_size,
-            'content_type': file_type
+            'content_type': file_type,
+            'codec': codec,
         }
-        file_url = default_storage.url(file_path)
+        self.record_uploaded([file_info])
 
-        # Store the file (this uses student state storage
-        # Save the file reference
+        # the previous files are replaced
+        self.replace_stored_files([file_info])
         self.submitted = True
-        return {"result": "success", "file_info": self.file_info}
+        return dict(self.rendered_content(), result="success", file_info=file_info)
 
     @XBlock.handler
+    @instrumented("download_file")
     def download_file(self, request, suffix=''):
-        """Secure file download with authentication"""
+        """
+        Secure file download with authentication.
+        `?variant=optimized` or `?variant=thumbnail` selects a processed variant
+        of the file; the optimized variant falls back to the original until it
+        has been made.
+        """
         log.debug('download_file called with suffix: %s', suffix)
 
         try:
@@ -235,10 +449,7 @@ class UploadFileBlock(StudioEditableXBlockMixin, XBlock):
                 file_index = int(suffix.strip('/'))
 
             # Get file list (handle both legacy single file and new multiple files)
-            file_info_list = self.file_info_list
-            if not file_info_list and self.file_info:
-                # Handle legacy single file
-                file_info_list = [self.file_info]
+            file_info_list = self.stored_files()
 
             if not file_info_list or file_index >= len(file_info_list):
                 log.warning("Download attempt with invalid file index %s: %s",
@@ -252,34 +463,67 @@ class UploadFileBlock(StudioEditableXBlockMixin, XBlock):
                 'content_type', 'application/octet-stream')
             user_filename = file_info.get('user_filename', 'download.bin')
             file_path = file_info['file_path']
+            # content-addressed files have a strong validator in their digest
+            etag = file_info.get('sha256')
+            codec = file_info.get('codec')
 
-            if not default_storage.exists(file_path):
+            variant = request.GET.get('variant', processing.ORIGINAL)
+            if variant != processing.ORIGINAL:
+                path = processing.variant_path(file_path, variant)
+                made = file_info.get('variants', []) + file_info.get('pending_variants', [])
+                if variant in made and storage.exists(path):
+                    file_path = path
+                    content_type = processing.variant_content_type(content_type, variant)
+                    user_filename = processing.variant_filename(user_filename, variant)
+                    etag = None
+                    # variants are stored as they are
+                    codec = None
+                elif variant != processing.OPTIMIZED:
+                    response = Response(status=404)
+                    response.text = "File not found"
+                    return response
+
+            if not storage.exists(file_path):
                 log.warning("File does not exist in storage: %s", file_path)
                 response = Response(status=404)
                 response.text = "File not found"
                 return response
 
-            # Read file content
-            file_content = default_storage.open(file_path).read()
-            encoded_filename = urllib.parse.quote(user_filename)
-
-            # Create WebOb response with proper headers
-            response = Response(
-                body=file_content,
-                content_type=content_type
-            )
-
-            # Set Content-Disposition header for download with proper filename
-            response.headers['Content-Disposition'] = f'attachment; filename="{user_filename}"; filename*=UTF-8\'\'{encoded_filename}'
-            response.headers['Content-Length'] = str(len(file_content))
-
-            # Disable caching
-            response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-            response.headers['Pragma'] = 'no-cache'
-            response.headers['Expires'] = '0'
+            if get_setting("DIRECT_STORAGE") and codec is None:
+                # let the browser fetch the file from storage directly
+                url = get_signer().download_url(
+                    self, file_path, user_filename, content_type, get_setting("SIGNED_URL_EXPIRY"))
+                response = Response(status=302, location=url)
+                response.headers['Cache-Control'] = 'no-store'
+                return response
 
-            log.debug('download_file: serving %s bytes as %s',
-                      len(file_content), user_filename)
+            # Stream the file in bounded chunks, honouring Range and conditional headers
+            (size, last_modified) = storage_metadata(storage, file_path)
+            etag = etag or make_etag(file_path, size, last_modified)
+            if codec is not None:
+                # sent as stored or decoded, depending on Accept-Encoding
+                response = encoded_response(
+                    request,
+                    lambda: storage.open(file_path, 'rb'),
+                    size,
+                    etag,
+                    last_modified,
+                    content_type,
+                    user_filename,
+                    codec,
+                    compression.decoder(codec),
+                )
+            else:
+                response = streaming_response(
+                    request,
+                    lambda: storage.open(file_path, 'rb'),
+                    size,
+                    etag,
+                    last_modified,
+                    content_type,
+                    user_filename,
+                )
+            get_metrics().incr("download.bytes", response.content_length or 0)
             return response
 
         except Exception as e:
@@ -306,77 +550,634 @@ class UploadFileBlock(StudioEditableXBlockMixin, XBlock):
         ]
 
     @XBlock.handler
+    @instrumented("stream_upload")
     def stream_upload(self, request, suffix=''):
         """
-        Handle streaming file upload using Django's built-in mechanisms.
-        This automatically handles the streaming without explicit chunking.
+        Handle a multipart/form-data upload of `files[]`.
+        The body is parsed incrementally, so the file size, total size and file type
+        limits are enforced while it is being received, and a rejected upload is
+        answered with 413 or 415 and the details of the rejected file.
         Because it is form data we must use webob responses and webob request.
         """
         log.debug("stream_upload: entry")
         if request.method != 'POST':
             log.debug("stream_upload: not POST")
-            return Response(json.dumps({"result": "error", "message": "Only POST allowed"}), content_type='application/json; charset=utf-8', status=400)
+            return json_response({"result": "error", "message": "Only POST allowed"}, status=400)
 
+        uploads = []
         try:
-            log.debug("stream_upload: POST")
-            uploaded_files = []
+            with get_metrics().timer("stream_upload.parse"):
+                uploads = self.read_uploads(request)
+            log.debug("stream_upload: files %s", [upload.name for upload in uploads])
+            self.check_quota(sum(upload.size for upload in uploads))
+            uploaded_files = self.process_uploaded_files(uploads)
 
-            # WebOb request - access files through POST property
-            log.debug("stream_upload: POST vars %s", request.POST)
-
-            files = request.POST.getall('files[]')
-            if not isinstance(files, list):
-                # only when when there is more than one, is it in a list
-                files = [files]
-            log.debug("stream_upload: files %s %s", files, type(files))
-            for file_var in files:
-                file = file_var.file
-                if (file.size <= self.max_size_mb * 1024 * 1024):
-                    log.debug('stream_upload file %s; %s', file, dir(file))
-                    file_info = self.process_uploaded_file(file)
-                    # In WebOb, uploaded files are in request.POST
-                    uploaded_files.append(file_info)
-                else:
-                    log.error("File size too big %d, %s, (%d)",
-                              file.size, file.name, self.max_size_mb)
-
-            self.file_info_list = uploaded_files
+            self.replace_stored_files(uploaded_files)
             self.submitted = True
 
-            return Response(json.dumps({
-                "result": "success",
-                "files_info": uploaded_files,
-                "count": len(uploaded_files)
-            }), content_type='application/json; charset=utf-8')
+            return json_response(dict(
+                self.rendered_content(),
+                result="success",
+                files_info=uploaded_files,
+                count=len(uploaded_files),
+            ))
 
+        except UploadRejected as e:
+            log.info("stream_upload: rejected %s", e.details)
+            get_metrics().incr("upload.rejected", reason=e.details["reason"])
+            return json_response({"result": "error", "message": str(e), "rejected": [e.details]}, status=e.status)
+        except UploadBatchError as e:
+            log.error("stream_upload: %s: %s", e, e.errors)
+            return json_response({"result": "error", "message": str(e), "rejected": e.errors}, status=500)
+        except MultipartError as e:
+            log.warning("stream_upload: invalid request body: %s", e)
+            return json_response({"result": "error", "message": str(e)}, status=400)
         except Exception as e:
             log.exception("Error in stream_upload: %s", str(e))
-            return Response(json.dumps({"result": "error", "message": str(e)}), content_type='application/json; charset=utf-8', status=500)
+            return json_response({"result": "error", "message": str(e)}, status=500)
+        finally:
+            for upload in uploads:
+                upload.close()
+
+    def read_uploads(self, request):
+        """
+        Reads the `files[]` of a multipart request into spooled uploaded files,
+        raising UploadRejected as soon as a limit is crossed.
+        """
+        max_total = self.max_total_size_mb * MB or None
+        if max_total is not None and (request.content_length or 0) > max_total:
+            raise UploadRejected(
+                413, "total_size", f"The upload is larger than {self.max_total_size_mb}Mb")
+
+        django_request = getattr(request, "_request", None)
+        if django_request is not None and getattr(django_request, "_read_started", False):
+            # The body was already parsed upstream (e.g. by middleware), so all
+            # that is left is to check the parsed files.
+            uploads = [file_var.file for file_var in request.POST.getall('files[]')]
+            for upload in uploads:
+                self.check_upload(upload.name, upload.size, upload.content_type)
+            return uploads
+
+        boundary = parse_boundary(request.headers.get("Content-Type"))
+        if boundary is None:
+            raise MultipartError("Expected a multipart/form-data body")
+        reader = MultipartReader(request.body_file, boundary, max_total=max_total)
+        uploads = []
+        try:
+            for (part, data) in reader.parts():
+                if part.name != "files[]" or not part.filename:
+                    continue
+                self.check_upload(part.filename, None, part.content_type)
+                uploads.append(spool_part(
+                    part, data, self.max_size_mb * MB, digest=get_setting("CONTENT_ADDRESSED_STORAGE")))
+        except Exception:
+            for upload in uploads:
+                upload.close()
+            raise
+        return uploads
+
+    def process_uploaded_files(self, files):
+        """
+        Stores a batch of uploaded files, writing up to STORAGE_CONCURRENCY of them
+        to storage at once. The file infos are returned in the order of `files`, so
+        the download indexes are stable. If any file fails, the files of the batch
+        that were already stored are deleted and UploadBatchError is raised.
+        """
+        outcomes = run_batch(self.process_uploaded_file, files, get_setting("STORAGE_CONCURRENCY"))
+        errors = [
+            {"filename": file.name, "reason": "storage", "message": str(error)}
+            for (file, (_result, error)) in zip(files, outcomes) if error is not None
+        ]
+        if errors:
+            self.delete_stored_files([result for (result, error) in outcomes if error is None])
+            raise UploadBatchError(errors, len(files))
+        results = [result for (result, _error) in outcomes]
+        self.record_uploaded(results)
+        return results
+
+    def record_uploaded(self, file_info_list):
+        """Counts newly stored files and queues them for post-processing."""
+        metrics = get_metrics()
+        for file_info in file_info_list:
+            metrics.incr("upload.files")
+            metrics.incr("upload.bytes", file_info['size'])
+            metrics.histogram("upload.file_size", file_info['size'])
+            usage.record(self.course_id(), self.scope_ids.usage_id, self.runtime.user_id, file_info['size'], 1)
+            variants = processing.planned_variants(file_info['content_type'])
+            if variants:
+                file_info['pending_variants'] = variants
+                file_info['queued_at'] = time.time()
+                if processing.schedule(file_info) is None:
+                    # the pool is broken, so the variants will not be made
+                    del file_info['pending_variants'], file_info['queued_at']
+
+    def resolve_variants(self):
+        """
+        Records the variants that processing has stored since the files were
+        uploaded. Returns True if the learner's files changed.
+        """
+        file_info_list = self.stored_files()
+        if not any(file_info.get('pending_variants') for file_info in file_info_list):
+            return False
+        now = time.time()
+        file_info_list = [dict(file_info) for file_info in file_info_list]
+        changed = [processing.resolve_variants(storage, file_info, now) for file_info in file_info_list]
+        if not any(changed):
+            return False
+        self.file_info_list = [compact_file_info(file_info) for file_info in file_info_list]
+        self.state_version = STATE_VERSION
+        if self.file_info:
+            del self.file_info
+        return True
+
+    def delete_stored_files(self, file_info_list):
+        for file_info in file_info_list:
+            if file_info.get('blob_ref'):
+                # shared blob: it may be used elsewhere, so leave it to the sweeper.
+                # The file was not recorded as uploaded, so it is not attributed.
+                try:
+                    blobs.release_ref(storage, file_info['sha256'], file_info['blob_ref'])
+                    journal_deletion(storage, file_info)
+                except Exception as e:
+                    log.warning("Failed to queue %s for deletion: %s", file_info['file_path'], e)
+                continue
+            try:
+                storage.delete(file_info['file_path'])
+            except Exception as e:
+                log.warning("Failed to delete %s: %s", file_info['file_path'], e)
+
+    def retire_stored_files(self, file_info_list):
+        """
+        Queues files that are no longer part of the learner's submission for
+        deletion by the sweeper, releasing their blob references first.
+        """
+        for file_info in file_info_list:
+            try:
+                if file_info.get('blob_ref'):
+                    blobs.release_ref(storage, file_info['sha256'], file_info['blob_ref'])
+                journal_deletion(storage, file_info, self.runtime.user_id, self.scope_ids.usage_id, self.course_id())
+                if file_info.get('size') is not None:
+                    usage.record(
+                        self.course_id(), self.scope_ids.usage_id, self.runtime.user_id,
+                        0, 0, pending_bytes=file_info['size'])
+            except Exception as e:
+                # at worst the file leaks until the next reconciliation
+                log.warning("Failed to queue %s for deletion: %s", file_info.get('file_path'), e)
+
+    def replace_stored_files(self, file_info_list):
+        """
+        Records `file_info_list` as the learner's files. The files it replaces,
+        including a legacy single file, are queued for deletion. The state is
+        written in the current schema version.
+        """
+        def identity(file_info):
+            # entries sharing a blob are told apart by their reference
+            return file_info.get('blob_ref') or file_info['file_path']
+
+        kept = {identity(file_info) for file_info in file_info_list}
+        superseded = [file_info for file_info in self.stored_files() if identity(file_info) not in kept]
+        self.retire_stored_files(superseded)
+        self.file_info_list = [compact_file_info(file_info) for file_info in file_info_list]
+        self.state_version = STATE_VERSION
+        if self.file_info:
+            del self.file_info
 
     def process_uploaded_file(self, file):
         """
         Process a single uploaded file that was streamed by Django.
         """
+        if get_setting("CONTENT_ADDRESSED_STORAGE"):
+            return self.process_content_addressed_file(file)
+
         # Get file metadata
         filename = file.name
         size = file.size
         content_type = file.content_type
 
-        # Create full filename
-        full_filename = self.full_filename(filename)
-
         # Save the file - Django handles the streaming internally
         # The uploaded_file is already a file-like object that can be saved directly
-        file_path = default_storage.save(full_filename, file)
-        file_url = default_storage.url(file_path)
+        (file_path, codec) = self.save_upload(file, filename, content_type)
 
         result = {
             'user_filename': filename,
-            'filename': full_filename,
             'file_path': file_path,
             'size': size,
             'content_type': content_type,
-            'file_url': file_url
+            'codec': codec,
         }
         log.debug("stream_upload: result %s", result)
         return result
+
+    def process_content_addressed_file(self, file):
+        """
+        Stores a file as a blob named by its SHA-256 digest, skipping the write
+        when the same content is already stored, and takes a reference to it.
+        """
+        (sha256, source) = blobs.content_hash(file)
+        # take the reference first, so the sweeper never sees an unreferenced
+        # blob that this upload is about to use
+        blob_ref = blobs.add_ref(storage, sha256, self.runtime.user_id, self.scope_ids.usage_id)
+        try:
+            (file_path, written) = blobs.store_blob(storage, source, sha256)
+        except Exception:
+            blobs.release_ref(storage, sha256, blob_ref)
+            raise
+        finally:
+            if source is not file:
+                source.close()
+
+        result = {
+            'user_filename': file.name,
+            'file_path': file_path,
+            'size': file.size,
+            'content_type': file.content_type,
+            'sha256': sha256,
+            'blob_ref': blob_ref,
+        }
+        log.debug("stream_upload: result %s (%s)", result, "stored" if written else "deduplicated")
+        return result
+
+    # Chunked, resumable uploads.
+    #
+    # upload_init starts a session for one file, upload_chunk stores a byte range
+    # of it, upload_status reports which ranges have arrived (to resume after a
+    # disconnect) and upload_finalize assembles a batch of completed sessions
+    # into the learner's submission. file_info_list only changes on finalize.
+
+    def upload_session(self, upload_id):
+        session = self.upload_sessions.get(upload_id)
+        if session is None:
+            raise JsonHandlerError(404, "Unknown upload")
+        return session
+
+    def upload_session_status(self, upload_id, session):
+        parts = chunks.received_parts(
+            storage, self.runtime.user_id, upload_id, session["size"], session["chunk_size"])
+        return {
+            "result": "success",
+            "upload_id": upload_id,
+            "size": session["size"],
+            "chunk_size": session["chunk_size"],
+            "received": [list(part) for part in parts],
+            "missing": chunks.missing_ranges(parts, session["size"]),
+        }
+
+    def discard_stale_upload_sessions(self, sessions):
+        now = time.time()
+        for (upload_id, session) in list(sessions.items()):
+            if now - session.get("created", 0) > UPLOAD_SESSION_TTL:
+                chunks.delete_parts(storage, self.runtime.user_id, upload_id)
+                del sessions[upload_id]
+
+    @XBlock.json_handler
+    @instrumented("upload_init")
+    def upload_init(self, data, suffix=''):
+        """
+        Starts a chunked upload session for one file, or resumes the session
+        given by `upload_id` if it is still open for the same file.
+        """
+        log.debug("upload_init %s", data)
+        filename = data.get("filename") or "upload.bin"
+        try:
+            size = int(data.get("file_size", -1))
+        except (TypeError, ValueError):
+            size = -1
+        content_type = data.get("file_type") or "application/octet-stream"
+
+        upload_id = data.get("upload_id")
+        session = self.upload_sessions.get(upload_id) if upload_id else None
+        if session and session["user_filename"] == filename and session["size"] == size:
+            return self.upload_session_status(upload_id, session)
+
+        if size < 0:
+            raise JsonHandlerError(400, "Missing file size")
+        self.check_json_upload(filename, size, content_type)
+
+        sessions = dict(self.upload_sessions)
+        self.discard_stale_upload_sessions(sessions)
+        # the other open sessions are usually part of the same submission
+        self.check_json_quota(size + sum(session["size"] for session in sessions.values()))
+        upload_id = uuid.uuid4().hex
+        session = {
+            "user_filename": filename,
+            "size": size,
+            "content_type": content_type,
+            "chunk_size": chunks.CHUNK_SIZE,
+            "created": time.time(),
+        }
+        sessions[upload_id] = session
+        self.upload_sessions = sessions
+        return self.upload_session_status(upload_id, session)
+
+    @XBlock.handler
+    @instrumented("upload_chunk")
+    def upload_chunk(self, request, suffix=''):
+        """
+        Stores one chunk of a chunked upload. The URL suffix is
+        `{upload_id}/{offset}` and the request body is the raw chunk.
+        Chunks start at multiples of the session's chunk size and all but
+        the last have that length. They may be sent in any order and in
+        parallel, and a chunk sent again replaces the earlier one.
+        """
+        if request.method not in ("POST", "PUT"):
+            return json_response({"result": "error", "message": "Only POST or PUT allowed"}, status=400)
+        (upload_id, _, offset) = suffix.strip("/").partition("/")
+        session = self.upload_sessions.get(upload_id)
+        if session is None:
+            return json_response({"result": "error", "message": "Unknown upload"}, status=404)
+        if not offset.isdigit():
+            return json_response({"result": "error", "message": "Invalid offset"}, status=400)
+        offset = int(offset)
+        expected = chunks.part_length(offset, session["size"], session["chunk_size"])
+        if expected is None:
+            return json_response({"result": "error", "message": "No chunk starts at this offset"}, status=400)
+        length = request.content_length
+        if length != expected:
+            return json_response(
+                {"result": "error", "message": f"The chunk at {offset} must be {expected} bytes"}, status=400)
+
+        try:
+            data = request.body_file.read(length)
+            if len(data) != length:
+                return json_response({"result": "error", "message": "Incomplete chunk"}, status=400)
+            chunks.save_part(storage, self.runtime.user_id, upload_id, offset, data)
+        except Exception as e:
+            log.exception("Error in upload_chunk: %s", str(e))
+            return json_response({"result": "error", "message": str(e)}, status=500)
+
+        log.debug("upload_chunk: %s stored %s bytes at %s", upload_id, length, offset)
+        return json_response({"result": "success", "offset": offset, "length": length})
+
+    @XBlock.json_handler
+    @instrumented("upload_status")
+    def upload_status(self, data, suffix=''):
+        """Reports the received and missing byte ranges of a chunked upload."""
+        upload_id = data.get("upload_id")
+        return self.upload_session_status(upload_id, self.upload_session(upload_id))
+
+    @XBlock.json_handler
+    @instrumented("upload_finalize")
+    def upload_finalize(self, data, suffix=''):
+        """
+        Assembles the completed chunked uploads in `upload_ids` and records them,
+        in order, as the learner's submission.
+        """
+        log.debug("upload_finalize %s", data)
+        upload_ids = data.get("upload_ids") or []
+        if not upload_ids:
+            raise JsonHandlerError(400, "No uploads to finalize")
+        user_id = self.runtime.user_id
+        self.check_json_quota(sum(self.upload_session(upload_id)["size"] for upload_id in upload_ids))
+
+        readers = []
+        for upload_id in upload_ids:
+            session = self.upload_session(upload_id)
+            try:
+                readers.append(chunks.PartsReader(
+                    storage, user_id, upload_id,
+                    session["user_filename"], session["size"], session["content_type"], session["chunk_size"]))
+            except chunks.IncompleteUpload as e:
+                raise JsonHandlerError(409, f"Upload of {session['user_filename']} is incomplete: {e}") from e
+
+        try:
+            uploaded_files = self.process_uploaded_files(readers)
+        except UploadBatchError as e:
+            raise JsonHandlerError(500, f"{e}: {e.errors}") from e
+        finally:
+            for reader in readers:
+                reader.close()
+        for upload_id in upload_ids:
+            chunks.delete_parts(storage, user_id, upload_id)
+
+        sessions = dict(self.upload_sessions)
+        for upload_id in upload_ids:
+            sessions.pop(upload_id, None)
+        self.upload_sessions = sessions
+        self.replace_stored_files(uploaded_files)
+        self.submitted = True
+        return dict(
+            self.rendered_content(),
+            result="success",
+            files_info=uploaded_files,
+            count=len(uploaded_files),
+        )
+
+    # Direct-to-storage uploads (DIRECT_STORAGE mode).
+    #
+    # presign_upload hands out a signed URL that the browser uploads one file to,
+    # and confirm_upload checks the stored files and records them as the
+    # learner's submission. The file bytes never pass through the LMS.
+
+    @XBlock.json_handler
+    @instrumented("presign_upload")
+    def presign_upload(self, data, suffix=''):
+        """
+        Returns a signed URL to upload one file to, with the `method` and
+        `headers` to use, and the `upload_token` to pass to confirm_upload.
+        """
+        if not get_setting("DIRECT_STORAGE"):
+            raise JsonHandlerError(404, "Direct uploads are not enabled")
+        log.debug("presign_upload %s", data)
+        filename = data.get("filename") or "upload.bin"
+        try:
+            size = int(data.get("file_size", -1))
+        except (TypeError, ValueError):
+            size = -1
+        content_type = data.get("file_type") or "application/octet-stream"
+        if size < 0:
+            raise JsonHandlerError(400, "Missing file size")
+        self.check_json_upload(filename, size, content_type)
+        self.check_json_quota(size)
+
+        file_path = self.full_filename(filename)
+        # each upload can be confirmed once, so remember it until then
+        now = time.time()
+        pending = {}
+        for (path, created) in self.direct_uploads.items():
+            if now - created <= UPLOAD_SESSION_TTL:
+                pending[path] = created
+            else:
+                # the token has expired, so whatever was uploaded can no longer be confirmed
+                try:
+                    journal_deletion(storage, {'file_path': path})
+                except Exception as e:
+                    log.warning("Failed to queue %s for deletion: %s", path, e)
+        pending[file_path] = now
+        self.direct_uploads = pending
+        target = get_signer().upload_url(
+            self, file_path, content_type, get_setting("SIGNED_URL_EXPIRY"), size)
+        upload_token = signing.dumps({
+            "file_path": file_path,
+            "user_filename": filename,
+            "size": size,
+            "content_type": content_type,
+        }, salt=CONFIRM_SALT)
+        return dict(target, result="success", upload_token=upload_token)
+
+    @XBlock.json_handler
+    @instrumented("confirm_upload")
+    def confirm_upload(self, data, suffix=''):
+        """
+        Checks the files uploaded through presign_upload URLs against the
+        declared size and the block limits, and records them, in order, as the
+        learner's submission. Each upload can only be confirmed once. If any
+        check fails, the files of all uploads of the request are deleted.
+        """
+        if not get_setting("DIRECT_STORAGE"):
+            raise JsonHandlerError(404, "Direct uploads are not enabled")
+        log.debug("confirm_upload %s", data)
+        upload_tokens = data.get("upload_tokens") or []
+        if not upload_tokens:
+            raise JsonHandlerError(400, "No uploads to confirm")
+
+        pending = dict(self.direct_uploads)
+        confirmed = []
+        try:
+            for upload_token in upload_tokens:
+                try:
+                    claims = signing.loads(upload_token, salt=CONFIRM_SALT, max_age=UPLOAD_SESSION_TTL)
+                except signing.BadSignature as e:
+                    raise JsonHandlerError(400, "Invalid upload token") from e
+                file_path = claims["file_path"]
+                if not file_path.startswith(f"xblock_uploadfile/{self.runtime.user_id}/"):
+                    raise JsonHandlerError(403, "Upload belongs to another user")
+                # a confirmed file may be part of the submission or queued for deletion
+                if pending.pop(file_path, None) is None:
+                    raise JsonHandlerError(409, f"{claims['user_filename']} has already been confirmed")
+                confirmed.append(claims)
+
+            uploaded_files = []
+            for claims in confirmed:
+                file_path = claims["file_path"]
+                if not storage.exists(file_path):
+                    raise JsonHandlerError(409, f"{claims['user_filename']} has not been uploaded")
+                size = storage.size(file_path)
+                if size != claims["size"]:
+                    raise UploadRejected(
+                        400, "file_size", f"{claims['user_filename']} does not have the declared size",
+                        claims["user_filename"])
+                self.check_upload(claims["user_filename"], size, claims["content_type"])
+                uploaded_files.append({
+                    'user_filename': claims["user_filename"],
+                    'file_path': file_path,
+                    'size': size,
+                    'content_type': claims["content_type"],
+                })
+            self.check_quota(sum(file_info['size'] for file_info in uploaded_files))
+        except (JsonHandlerError, UploadRejected) as e:
+            self.direct_uploads = pending
+            self.delete_stored_files([{'file_path': claims["file_path"]} for claims in confirmed])
+            if isinstance(e, UploadRejected):
+                get_metrics().incr("upload.rejected", reason=e.details["reason"])
+                raise JsonHandlerError(e.status, str(e)) from e
+            raise
+
+        self.direct_uploads = pending
+        self.record_uploaded(uploaded_files)
+        self.replace_stored_files(uploaded_files)
+        self.submitted = True
+        return dict(
+            self.rendered_content(),
+            result="success",
+            files_info=uploaded_files,
+            count=len(uploaded_files),
+        )
+
+    @XBlock.handler
+    @instrumented("local_storage")
+    def local_storage(self, request, suffix=''):
+        """
+        Serves the signed URLs of LocalSigner, the stand-in for storage backends
+        that cannot sign URLs: PUT stores and GET returns the object named in
+        the token.
+        """
+        try:
+            claims = LocalSigner.verify(urllib.parse.unquote(suffix), request.method)
+        except signing.BadSignature:
+            return json_response({"result": "error", "message": "Invalid or expired URL"}, status=403)
+        file_path = claims["path"]
+
+        if request.method == "PUT":
+            length = request.content_length
+            if length is None or length > min(claims["max_size"], self.max_size_mb * MB):
+                return json_response({"result": "error", "message": "File too large"}, status=413)
+            if storage.exists(file_path):
+                return json_response({"result": "error", "message": "Already uploaded"}, status=409)
+            storage.save(file_path, File(request.body_file, name=file_path))
+            return json_response({"result": "success"})
+
+        if not storage.exists(file_path):
+            return json_response({"result": "error", "message": "File not found"}, status=404)
+        (size, last_modified) = storage_metadata(storage, file_path)
+        return streaming_response(
+            request,
+            lambda: storage.open(file_path, 'rb'),
+            size,
+            make_etag(file_path, size, last_modified),
+            last_modified,
+            claims["content_type"],
+            claims["user_filename"],
+        )
+
+    def is_course_staff(self):
+        user_service = self.runtime.service(self, 'user')
+        if user_service is not None:
+            return bool(user_service.get_current_user().opt_attrs.get(ATTR_KEY_USER_IS_STAFF))
+        return bool(getattr(self.runtime, 'user_is_staff', False))
+
+    def learner_submissions(self):
+        """Returns an iterator of (username, file_info_list) for every learner."""
+        return (
+            (username, learner_files(state))
+            for (username, state) in iter_learner_states(self.scope_ids.usage_id)
+        )
+
+    @XBlock.handler
+    @instrumented("export_submissions")
+    def export_submissions(self, request, suffix=''):
+        """
+        Staff only: streams a ZIP of the files submitted by every learner, one
+        folder per learner. With `?manifest=1` a CSV of the files' sizes and
+        content types is added.
+        """
+        if not self.is_course_staff():
+            return json_response({"result": "error", "message": "Only course staff can export submissions"}, status=403)
+        try:
+            submissions = self.learner_submissions()
+        except ImportError:
+            return json_response({"result": "error", "message": "Export is not available in this runtime"}, status=501)
+
+        manifest = request.GET.get('manifest', '').lower() in ('1', 'true', 'yes')
+        response = Response(
+            app_iter=iter_zip(storage, submissions, manifest=manifest),
+            content_type='application/zip',
+        )
+        response.headers['Content-Disposition'] = content_disposition(f"{safe_name(self.display_name)}-submissions.zip")
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+
+    @XBlock.json_handler
+    @instrumented("usage_report")
+    def usage_report(self, data, suffix=''):
+        """
+        Staff only: reports the bytes and files stored by all learners of the
+        block and of its course, and with `user_id` by one learner, from the
+        usage index.
+        """
+        if not self.is_course_staff():
+            raise JsonHandlerError(403, "Only course staff can see storage usage")
+        course_id = self.course_id()
+        usage_id = self.scope_ids.usage_id
+        block_usage = usage.usage(course_id, usage_id)
+        if block_usage is None:
+            raise JsonHandlerError(501, "The usage index is not available in this runtime")
+        report = {
+            "result": "success",
+            "block": block_usage,
+            "course": usage.usage(course_id),
+            "learner_quota_mb": self.learner_quota_mb,
+            "block_quota_mb": self.block_quota_mb,
+        }
+        if data.get("user_id"):
+            report["learner"] = usage.usage(course_id, usage_id, data["user_id"])
+        return report
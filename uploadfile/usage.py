@@ -0,0 +1,86 @@
+"""
+Storage accounting for UploadFile blocks.
+
+An index of the bytes and files that learners have stored, kept up to date
+as files are uploaded and reclaimed, so usage can be reported and quotas
+enforced without listing storage. Each change updates three rows of
+StorageUsage: the learner's row for the block, the block total and the course
+total, so any of them is read with a single lookup.
+
+A file counts from the time it is stored until the sweeper has processed it
+after it was replaced, since until then it still takes up storage. Replaced
+files that are waiting for the sweeper are also counted in `pending_bytes`, so
+the learner quota can leave them out. Files of content-addressed storage count
+once per reference.
+
+The index needs `uploadfile` in the LMS INSTALLED_APPS and its migrations
+applied. Without it nothing is recorded and `usage` returns None.
+"""
+import logging
+
+from django.apps import apps
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+log = logging.getLogger(__name__)
+
+
+def is_available():
+    return apps.is_installed("uploadfile")
+
+
+def _keys(course_id, usage_id, user_id):
+    return [
+        {"course_id": course_id, "usage_id": usage_id, "user_id": user_id},
+        {"course_id": course_id, "usage_id": usage_id, "user_id": ""},
+        {"course_id": course_id, "usage_id": "", "user_id": ""},
+    ]
+
+
+def _add(model, key, size, files, pending_bytes):
+    changes = {
+        "bytes": F("bytes") + size,
+        "files": F("files") + files,
+        "pending_bytes": F("pending_bytes") + pending_bytes,
+    }
+    if model.objects.filter(**key).update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(bytes=size, files=files, pending_bytes=pending_bytes, **key)
+    except IntegrityError:
+        # the row was created concurrently
+        model.objects.filter(**key).update(**changes)
+
+
+def record(course_id, usage_id, user_id, size, files, pending_bytes=0):
+    """
+    Adds `size` bytes and `files` files (negative when they are reclaimed)
+    and `pending_bytes` bytes of replaced files (negative when they are
+    reclaimed) to the usage of a learner in a block, and to the block and
+    course totals. Failures are logged, as they must not fail the upload.
+    """
+    if not is_available() or not usage_id or user_id is None:
+        return
+    from .models import StorageUsage  # pylint: disable=import-outside-toplevel
+    try:
+        with transaction.atomic():
+            for key in _keys(str(course_id), str(usage_id), str(user_id)):
+                _add(StorageUsage, key, size, files, pending_bytes)
+    except Exception as e:  # pylint: disable=broad-except
+        log.warning("Failed to record the usage of %s in %s: %s", user_id, usage_id, e)
+
+
+def usage(course_id, usage_id="", user_id=""):
+    """
+    Returns {"bytes", "files", "pending_bytes"} stored by a learner in a block,
+    by a block (without `user_id`) or by a course (without `usage_id`), or None
+    if the index is not available.
+    """
+    if not is_available():
+        return None
+    from .models import StorageUsage  # pylint: disable=import-outside-toplevel
+    row = StorageUsage.objects.filter(
+        course_id=str(course_id), usage_id=str(usage_id), user_id=str(user_id),
+    ).values("bytes", "files", "pending_bytes").first()
+    return row or {"bytes": 0, "files": 0, "pending_bytes": 0}